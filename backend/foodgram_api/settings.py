@@ -78,6 +78,23 @@ DATABASES = {
 
 DATABASES['default'] = DATABASES['dev' if DEBUG else 'default']
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', '/tmp/foodgram_cache'),
+        # версии справочников и COUNT, ответы справочников, COUNT
+        # запросов на 30 секунд и списки покупок пользователей на час;
+        # при заполнении удаляется 1/CULL_FREQUENCY случайных записей
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 20000)),
+            'CULL_FREQUENCY': int(os.getenv('CACHE_CULL_FREQUENCY', 10)),
+        },
+    }
+}
+
 AUTH_USER_MODEL = 'users.User'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -5,3 +5,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram_api.settings')
 
 application = get_wsgi_application()
+
+# буфер просмотров в каждом процессе сервера сбрасывает фоновый поток
+from recipes.services import ViewTracker  # noqa: E402 isort:skip
+
+ViewTracker.start()
@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
 
 from .models import (
-    FavoriteList, Ingredient, IngredientsAmount, Recipe, ShoppingCart, Tag,
+    FavoriteList, Ingredient, IngredientsAmount, Recipe, RecipeViewStat,
+    ShoppingCart, Tag,
 )
 
 
@@ -49,25 +50,29 @@ class IngredientAdmin(admin.ModelAdmin):
 
 @admin.register(IngredientsAmount)
 class IngredientsAmountAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'amount', )
-    search_fields = ('id', 'ingredient__name')
+    list_display = ('id', 'recipe', 'name', 'amount', )
+    search_fields = ('id', 'recipe__name', 'ingredient__name')
+    list_select_related = ('recipe', 'ingredient', )
+
+
+class IngredientsAmountInline(admin.TabularInline):
+    model = IngredientsAmount
+    autocomplete_fields = ('ingredient', )
+    extra = 1
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author_name', )
+    list_display = ('id', 'name', 'author_name', 'favorites_count', )
     search_fields = ('id', 'name', )
     list_filter = ('name', 'author', 'tags', )
-    readonly_fields = ('favorite_count', )
+    readonly_fields = ('favorites_count', 'cart_count', )
+    inlines = (IngredientsAmountInline, )
 
     def author_name(self, obj):
         return obj.author.username
 
-    def favorite_count(self, obj):
-        return obj.favorite_lists.count()
-
     author_name.short_description = _('Имя автора')
-    favorite_count.short_description = _('Добавлено в избранное')
 
 
 @admin.register(FavoriteList)
@@ -84,3 +89,15 @@ class AuthorRecipesListAdmin(admin.ModelAdmin):
 
     author_name.short_description = _('Имя автора')
     recipe_name.short_description = _('Название рецепта')
+
+
+@admin.register(RecipeViewStat)
+class RecipeViewStatAdmin(admin.ModelAdmin):
+    list_display = ('hour', 'recipe_name', 'views', 'impressions', )
+    list_select_related = ('recipe', )
+    date_hierarchy = 'hour'
+
+    def recipe_name(self, obj):
+        return obj.recipe.name
+
+    recipe_name.short_description = _('Название рецепта')
@@ -1,6 +1,13 @@
+import atexit
+
 from django.apps import AppConfig
 
 
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .services import ViewTracker
+        atexit.register(ViewTracker.flush_on_exit)
@@ -0,0 +1,48 @@
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Передает весь список первичных ключей в child_relation, чтобы
+    объекты были получены одним запросом.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.to_internal_value_bulk(data)
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """ PrimaryKeyRelatedField, который при many=True получает все объекты
+    одним запросом id__in и сообщает сразу обо всех несуществующих id.
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_internal_value_bulk(self, data) -> list:
+        """:return: list(obj) в порядке переданных id"""
+        pks = []
+        for pk in data:
+            if isinstance(pk, bool):
+                self.fail('incorrect_type', data_type=type(pk).__name__)
+            try:
+                pks.append(int(pk))
+            except (TypeError, ValueError):
+                self.fail('incorrect_type', data_type=type(pk).__name__)
+        objects = self.get_queryset().in_bulk(set(pks))
+        missing = [pk for pk in pks if pk not in objects]
+        if missing:
+            raise serializers.ValidationError([
+                self.error_messages['does_not_exist'].format(pk_value=pk)
+                for pk in missing
+            ], code='does_not_exist')
+        return [objects[pk] for pk in pks]
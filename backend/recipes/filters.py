@@ -1,7 +1,36 @@
-from django_filters import rest_framework as filters
+from django import forms
+from django.core.validators import MaxValueValidator
+from django.db.models import Exists, OuterRef
+from django_filters import fields, rest_framework as filters
 from rest_framework.filters import SearchFilter
 
-from .models import Recipe, Tag
+from .models import Recipe
+from .services import RecipeIngredientSet, RecipeSearch, TagMap
+
+
+class IntegerFilter(filters.NumberFilter):
+    """ Целые числа в пределах bigint: дробные id дают 400, а не
+    отбрасывание дробной части.
+    """
+    field_class = forms.IntegerField
+
+    def get_max_validator(self):
+        return MaxValueValidator(2 ** 63 - 1)
+
+
+class IntegerInFilter(filters.BaseInFilter, IntegerFilter):
+    pass
+
+
+class SlugMultipleChoiceField(fields.MultipleChoiceField):
+    """ Неизвестные slug не ошибка валидации, их пропускает метод фильтра.
+    """
+    def valid_value(self, value):
+        return True
+
+
+class SlugMultipleChoiceFilter(filters.MultipleChoiceFilter):
+    field_class = SlugMultipleChoiceField
 
 
 class IngredientFilter(SearchFilter):
@@ -9,24 +38,61 @@ class IngredientFilter(SearchFilter):
 
 
 class RecipeFilter(filters.FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+    tags = SlugMultipleChoiceFilter(
+        choices=lambda: [(x, x) for x in TagMap.get().ids],
+        method='filter_tags'
     )
     is_favorited = filters.BooleanFilter(method='check_recipes_in')
     is_in_shopping_cart = filters.BooleanFilter(method='check_recipes_in')
+    search = filters.CharFilter(method='search_recipes')
+    ingredients = IntegerInFilter(method='filter_ingredients')
+    exclude_ingredients = IntegerInFilter(method='filter_ingredients')
+    ordering = filters.ChoiceFilter(choices=(('trending', 'trending'), ),
+                                    method='order_recipes')
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart', )
+        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ingredients', 'exclude_ingredients',
+                  'ordering', )
+
+    def filter_tags(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тегов: EXISTS по tag_id без JOIN и
+        DISTINCT, slug переводятся в id по TagMap без запроса к базе.
+        Пустой tags не фильтрует, неизвестные slug пропускаются.
+        """
+        slugs = [slug for slug in value if slug]
+        if not slugs:
+            return queryset
+        ids = TagMap.get().ids
+        tag_ids = [ids[slug] for slug in slugs if slug in ids]
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(recipe_id=OuterRef('pk'),
+                                               tag_id__in=tag_ids)
+        ))
 
     def check_recipes_in(self, queryset, name, value):
-        rm = {
-            'is_favorited': self.request.user.favorite_lists,
-            'is_in_shopping_cart': self.request.user.shopping_lists,
-        }
+        """Фильтрует по аннотациям, добавленным в RecipeView.get_queryset.
+        """
         if bool(value):
-            recipes_id = rm.get(name).values_list('recipe__id', flat=True)
-            return queryset.filter(id__in=recipes_id)
+            return queryset.filter(**{name: True})
         return queryset
+
+    def search_recipes(self, queryset, name, value):
+        """Полнотекстовый поиск, результаты сортируются по релевантности."""
+        return RecipeSearch().filter(queryset, value)
+
+    def filter_ingredients(self, queryset, name, value):
+        """Рецепты со всеми ингредиентами из ingredients и без ингредиентов
+        из exclude_ingredients (id через запятую).
+        """
+        if name == 'ingredients':
+            return RecipeIngredientSet().filter(queryset, include=value)
+        return RecipeIngredientSet().filter(queryset, exclude=value)
+
+    def order_recipes(self, queryset, name, value):
+        """ordering=trending: по популярности из TrendingScore по индексу
+        recipe_trending_idx. Фильтр применяется последним и заменяет
+        сортировку поиска и фильтра ингредиентов.
+        """
+        return queryset.order_by('-trending_score', '-id')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from recipes.services import IngredientRelations
+
+
+class Command(BaseCommand):
+    help = ('Перестраивает таблицу сочетаний и замен ингредиентов по '
+            'составу рецептов.')
+
+    def handle(self, *args, **options):
+        saved = IngredientRelations().build()
+        self.stdout.write(f'Сохранено связей ингредиентов: {saved}')
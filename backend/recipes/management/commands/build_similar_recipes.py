@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from recipes.services import SimilarRecipes
+
+
+class Command(BaseCommand):
+    help = ('Перестраивает таблицу похожих рецептов по совместному '
+            'добавлению в избранное.')
+
+    def handle(self, *args, **options):
+        saved = SimilarRecipes().build()
+        self.stdout.write(f'Сохранено пар похожих рецептов: {saved}')
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+from recipes.services import CounterBuffer
+
+
+class Command(BaseCommand):
+    help = ('Записывает в базу отложенные счетчики избранного и списков '
+            'покупок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Повторять сброс каждые interval секунд.')
+
+    def handle(self, *args, interval, **options):
+        while True:
+            recounted = CounterBuffer().flush()
+            if recounted or not interval:
+                self.stdout.write(f'Пересчитано рецептов: {recounted}')
+            if not interval:
+                return
+            time.sleep(interval)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from recipes.services import COUNTERS, count_subquery
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики избранного, списков покупок, рецептов '
+            'и подписчиков по связанным таблицам.')
+
+    def handle(self, *args, **options):
+        """Каждый счетчик исправляется одним UPDATE, который затрагивает
+        только строки, где сохраненное значение разошлось с COUNT.
+        """
+        for model, field, source, source_field in COUNTERS:
+            count = count_subquery(source, source_field)
+            updated = model.objects.exclude(
+                **{field: count}
+            ).update(**{field: count})
+            self.stdout.write(
+                f'{model._meta.label}.{field}: исправлено {updated}')
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+from recipes.services import TrendingScore
+
+
+class Command(BaseCommand):
+    help = ('Добавляет к популярности рецептов новые записи избранного и '
+            'списков покупок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Повторять обновление каждые interval секунд.')
+
+    def handle(self, *args, interval, **options):
+        while True:
+            refreshed = TrendingScore().refresh()
+            if refreshed or not interval:
+                self.stdout.write(f'Обновлено рецептов: {refreshed}')
+            if not interval:
+                return
+            time.sleep(interval)
@@ -0,0 +1,87 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_amounts_to_recipes(apps, schema_editor):
+    """Переносит связи recipe_ingredients в поле IngredientsAmount.recipe.
+
+    Количество, привязанное к нескольким рецептам, копируется для каждого
+    рецепта, повторяющиеся ингредиенты рецепта суммируются, количества
+    без рецепта удаляются.
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    IngredientsAmount = apps.get_model('recipes', 'IngredientsAmount')
+    through = Recipe.old_ingredients.through
+
+    seen = {}
+    assigned = set()
+    for link in through.objects.select_related(
+            'ingredientsamount').order_by('id').iterator():
+        amount = link.ingredientsamount
+        key = (link.recipe_id, amount.ingredient_id)
+        if key in seen:
+            IngredientsAmount.objects.filter(pk=seen[key]).update(
+                amount=models.F('amount') + amount.amount)
+            continue
+        if amount.pk not in assigned:
+            IngredientsAmount.objects.filter(pk=amount.pk).update(
+                recipe_id=link.recipe_id)
+            assigned.add(amount.pk)
+            seen[key] = amount.pk
+        else:
+            seen[key] = IngredientsAmount.objects.create(
+                recipe_id=link.recipe_id,
+                ingredient_id=amount.ingredient_id,
+                amount=amount.amount,
+            ).pk
+    IngredientsAmount.objects.filter(recipe__isnull=True).delete()
+
+
+def move_amounts_to_m2m(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    IngredientsAmount = apps.get_model('recipes', 'IngredientsAmount')
+    through = Recipe.old_ingredients.through
+    through.objects.bulk_create(
+        through(recipe_id=recipe_id, ingredientsamount_id=amount_id)
+        for amount_id, recipe_id in IngredientsAmount.objects.values_list(
+            'id', 'recipe_id').iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='recipe',
+            old_name='ingredients',
+            new_name='old_ingredients',
+        ),
+        migrations.AddField(
+            model_name='ingredientsamount',
+            name='recipe',
+            field=models.ForeignKey(help_text='Рецепт, к которому относится ингредиент.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ingredient_amounts', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.RunPython(move_amounts_to_recipes, move_amounts_to_m2m),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='old_ingredients',
+        ),
+        migrations.AlterField(
+            model_name='ingredientsamount',
+            name='recipe',
+            field=models.ForeignKey(help_text='Рецепт, к которому относится ингредиент.', on_delete=django.db.models.deletion.CASCADE, related_name='ingredient_amounts', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients',
+            field=models.ManyToManyField(blank=True, help_text='Ингредиенты к рецепту.', related_name='recipes', through='recipes.IngredientsAmount', to='recipes.Ingredient', verbose_name='Ингредиенты'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientsamount',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_recipe_ingredient'),
+        ),
+    ]
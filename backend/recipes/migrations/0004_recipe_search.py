@@ -0,0 +1,60 @@
+from django.db import migrations
+
+TABLE = 'recipes_recipe_search'
+
+
+def create_search_table(apps, schema_editor):
+    """Таблица документов полнотекстового поиска: tsvector с GIN индексом
+    на PostgreSQL, виртуальная таблица FTS5 на SQLite. Документы
+    существующих рецептов заполняются сразу.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE TABLE {TABLE} ('
+            'recipe_id bigint PRIMARY KEY, document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX {TABLE}_document ON {TABLE} USING gin (document)'
+        )
+        schema_editor.execute(
+            f"INSERT INTO {TABLE} (recipe_id, document) "
+            "SELECT r.id, "
+            "setweight(to_tsvector('russian', r.name), 'A') || "
+            "setweight(to_tsvector('russian', r.text), 'B') || "
+            "setweight(to_tsvector('russian', "
+            "coalesce(string_agg(i.name, ' '), '')), 'C') "
+            "FROM recipes_recipe r "
+            "LEFT JOIN recipes_ingredientsamount a ON a.recipe_id = r.id "
+            "LEFT JOIN recipes_ingredient i ON i.id = a.ingredient_id "
+            "GROUP BY r.id"
+        )
+    elif schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+            "name, text, ingredients, tokenize='unicode61')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {TABLE} (rowid, name, text, ingredients) "
+            "SELECT r.id, r.name, r.text, "
+            "coalesce(group_concat(i.name, ' '), '') "
+            "FROM recipes_recipe r "
+            "LEFT JOIN recipes_ingredientsamount a ON a.recipe_id = r.id "
+            "LEFT JOIN recipes_ingredient i ON i.id = a.ingredient_id "
+            "GROUP BY r.id"
+        )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_recipe_ingredients_through'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+TABLE = 'recipes_recipe_ingredient_set'
+
+
+def create_ingredient_set_table(apps, schema_editor):
+    """Таблица множеств ингредиентов рецептов: bigint[] с GIN индексом на
+    PostgreSQL, строка ',id,id,' на SQLite. Множества существующих
+    рецептов заполняются сразу.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE TABLE {TABLE} ('
+            'recipe_id bigint PRIMARY KEY, '
+            'ingredient_ids bigint[] NOT NULL, '
+            'ingredient_count integer NOT NULL)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX {TABLE}_ingredient_ids ON {TABLE} '
+            'USING gin (ingredient_ids)'
+        )
+        schema_editor.execute(
+            f"INSERT INTO {TABLE} "
+            "(recipe_id, ingredient_ids, ingredient_count) "
+            "SELECT r.id, coalesce(array_agg(a.ingredient_id "
+            "ORDER BY a.ingredient_id) FILTER "
+            "(WHERE a.ingredient_id IS NOT NULL), '{}'), "
+            "count(a.ingredient_id) "
+            "FROM recipes_recipe r "
+            "LEFT JOIN recipes_ingredientsamount a ON a.recipe_id = r.id "
+            "GROUP BY r.id"
+        )
+    elif schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE TABLE {TABLE} ('
+            'recipe_id integer PRIMARY KEY, '
+            'ingredient_ids text NOT NULL, '
+            'ingredient_count integer NOT NULL)'
+        )
+        schema_editor.execute(
+            f"INSERT INTO {TABLE} "
+            "(recipe_id, ingredient_ids, ingredient_count) "
+            "SELECT r.id, "
+            "coalesce(',' || group_concat(a.ingredient_id, ',') || ',', "
+            "','), count(a.ingredient_id) "
+            "FROM recipes_recipe r "
+            "LEFT JOIN recipes_ingredientsamount a ON a.recipe_id = r.id "
+            "GROUP BY r.id"
+        )
+
+
+def drop_ingredient_set_table(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_ingredient_set_table,
+                             drop_ingredient_set_table),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-18 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_ingredient_set'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-updated_at', '-id'], name='recipe_updated_at_id_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.5 on 2026-10-18 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_updated_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='favoritelist',
+            index=models.Index(fields=['author', '-updated_at'], name='favorite_author_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-updated_at'], name='recipe_author_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['author', '-updated_at'], name='cart_author_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.5 on 2026-10-18 19:03
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('recipes.Recipe', 'favorites_count', 'recipes.FavoriteList', 'recipe'),
+    ('recipes.Recipe', 'cart_count', 'recipes.ShoppingCart', 'recipe'),
+    ('users.User', 'recipes_count', 'recipes.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Subscription', 'following'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for model, field, source, source_field in COUNTERS:
+        source = apps.get_model(source)
+        count = Coalesce(Subquery(
+            source.objects.filter(
+                **{source_field: OuterRef('pk')}
+            ).order_by().values(source_field).annotate(
+                count=Count('pk')
+            ).values('count')
+        ), 0)
+        apps.get_model(model).objects.update(**{field: count})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_hot_lookup_indexes'),
+        ('users', '0003_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Обновляется автоматически при изменении списков покупок.', verbose_name='Добавлено в списки покупок'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Обновляется автоматически при изменении избранного.', verbose_name='Добавлено в избранное'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.5 on 2026-10-18 19:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeViewStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='Начало часа, за который собрана статистика.', verbose_name='Час')),
+                ('views', models.PositiveIntegerField(default=0, help_text='Количество открытий страницы рецепта.', verbose_name='Просмотры')),
+                ('impressions', models.PositiveIntegerField(default=0, help_text='Количество показов рецепта в списках.', verbose_name='Показы')),
+                ('recipe', models.ForeignKey(help_text='Просмотренный рецепт.', on_delete=django.db.models.deletion.CASCADE, related_name='view_stats', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Статистика просмотров',
+                'verbose_name_plural': 'Статистика просмотров',
+                'ordering': ('-hour',),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recipeviewstat',
+            constraint=models.UniqueConstraint(fields=('recipe', 'hour'), name='unique_recipe_view_stat'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.5 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_view_stat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Название периодической задачи.', max_length=50, unique=True, verbose_name='Название')),
+                ('value', models.DateTimeField(help_text='Время, до которого задача обработала данные.', verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Отметка обработки',
+                'verbose_name_plural': 'Отметки обработки',
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False, help_text='Затухающая со временем сумма добавлений в избранное и списки покупок, пересчитывается периодически.', verbose_name='Популярность'),
+        ),
+        migrations.AddIndex(
+            model_name='favoritelist',
+            index=models.Index(fields=['updated_at'], name='favorite_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending_score', '-id'], name='recipe_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['updated_at'], name='cart_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.5 on 2026-10-18 19:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_neighbour'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientRelation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('pair', 'Сочетается'), ('substitute', 'Заменяет')], help_text='Сочетание или замена.', max_length=10, verbose_name='Тип связи')),
+                ('score', models.FloatField(help_text='PMI для сочетаний, косинусная мера контекстов для замен.', verbose_name='Оценка')),
+                ('ingredient', models.ForeignKey(help_text='Ингредиент, для которого подобраны связанные.', on_delete=django.db.models.deletion.CASCADE, related_name='relations', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('related', models.ForeignKey(help_text='Ингредиент, который сочетается с ингредиентом или заменяет его.', on_delete=django.db.models.deletion.CASCADE, related_name='related_to', to='recipes.ingredient', verbose_name='Связанный ингредиент')),
+            ],
+            options={
+                'verbose_name': 'Связь ингредиентов',
+                'verbose_name_plural': 'Связи ингредиентов',
+                'ordering': ('ingredient', 'kind', '-score'),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientrelation',
+            constraint=models.UniqueConstraint(fields=('ingredient', 'kind', 'related'), name='unique_ingredient_relation'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.5 on 2026-10-18 19:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_ingredient_relation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipe', models.ForeignKey(db_constraint=False, db_index=False, help_text='Рецепт, счетчики которого нужно пересчитать.', on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Отложенный пересчет счетчиков',
+                'verbose_name_plural': 'Отложенные пересчеты счетчиков',
+            },
+        ),
+    ]
@@ -81,44 +81,10 @@ class Ingredient(models.Model):
         return f'{self.name} ({self.measurement_unit})'
 
 
-class IngredientsAmount(models.Model):
-    ingredient = models.ForeignKey(
-        Ingredient,
-        related_name='recipe_ingredients',
-        on_delete=models.CASCADE,
-        verbose_name=_('Ингредиент'),
-        help_text=_('Ингредиент необходимый для рецепта.'),
-    )
-    amount = models.IntegerField(
-        verbose_name=_('Количество'),
-        help_text=_('Количество ингредиента.'),
-        validators=[
-            validators.MinValueValidator(
-                limit_value=1,
-                message='Значение должно быть не меньше 1')]
-    )
-    updated_at = models.DateTimeField(
-        auto_now=True,
-        verbose_name=_('Дата обновления записи'),
-        help_text=_('Задается автоматически при обновлении записи.')
-    )
-
-    class Meta:
-        verbose_name = _('Количество ингредиентов')
-        verbose_name_plural = _('Количество ингредиентов')
-        ordering = ('ingredient',)
-
-    def __str__(self):
-        return f'{self.name} {self.amount} {self.ingredient.measurement_unit}'
-
-    @property
-    def name(self):
-        return self.ingredient.name
-
-
 class Recipe(models.Model):
     ingredients = models.ManyToManyField(
-        IngredientsAmount,
+        Ingredient,
+        through='IngredientsAmount',
         related_name='recipes',
         blank=True,
         verbose_name=_('Ингредиенты'),
@@ -160,6 +126,26 @@ class Recipe(models.Model):
         verbose_name=_('Автор'),
         help_text=_('Автор рецепта.'),
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('Добавлено в избранное'),
+        help_text=_('Обновляется автоматически при изменении избранного.')
+    )
+    cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('Добавлено в списки покупок'),
+        help_text=_('Обновляется автоматически при изменении списков '
+                    'покупок.')
+    )
+    trending_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name=_('Популярность'),
+        help_text=_('Затухающая со временем сумма добавлений в избранное и '
+                    'списки покупок, пересчитывается периодически.')
+    )
     updated_at = models.DateTimeField(
         auto_now=True,
         verbose_name=_('Дата обновления записи'),
@@ -170,11 +156,65 @@ class Recipe(models.Model):
         verbose_name = _('Рецепт')
         verbose_name_plural = _('Рецепты')
         ordering = ('-updated_at',)
+        indexes = (
+            models.Index(fields=('-updated_at', '-id'),
+                         name='recipe_updated_at_id_idx'),
+            models.Index(fields=('author', '-updated_at'),
+                         name='recipe_author_updated_idx'),
+            models.Index(fields=('-trending_score', '-id'),
+                         name='recipe_trending_idx'),
+        )
 
     def __str__(self):
         return self.name
 
 
+class IngredientsAmount(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='ingredient_amounts',
+        on_delete=models.CASCADE,
+        verbose_name=_('Рецепт'),
+        help_text=_('Рецепт, к которому относится ингредиент.'),
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='recipe_ingredients',
+        on_delete=models.CASCADE,
+        verbose_name=_('Ингредиент'),
+        help_text=_('Ингредиент необходимый для рецепта.'),
+    )
+    amount = models.IntegerField(
+        verbose_name=_('Количество'),
+        help_text=_('Количество ингредиента.'),
+        validators=[
+            validators.MinValueValidator(
+                limit_value=1,
+                message='Значение должно быть не меньше 1')]
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_('Дата обновления записи'),
+        help_text=_('Задается автоматически при обновлении записи.')
+    )
+
+    class Meta:
+        verbose_name = _('Количество ингредиентов')
+        verbose_name_plural = _('Количество ингредиентов')
+        ordering = ('ingredient',)
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'ingredient'],
+                                    name='unique_recipe_ingredient')
+        ]
+
+    def __str__(self):
+        return f'{self.name} {self.amount} {self.ingredient.measurement_unit}'
+
+    @property
+    def name(self):
+        return self.ingredient.name
+
+
 class ShoppingCart(models.Model):
     author = models.ForeignKey(
         User,
@@ -201,6 +241,12 @@ class ShoppingCart(models.Model):
         verbose_name = _('Список покупок')
         verbose_name_plural = _('Списки покупок')
         ordering = ('-updated_at',)
+        indexes = (
+            models.Index(fields=('author', '-updated_at'),
+                         name='cart_author_updated_idx'),
+            models.Index(fields=('updated_at', ),
+                         name='cart_updated_idx'),
+        )
         constraints = [
             models.UniqueConstraint(fields=['author', 'recipe'],
                                     name='unique_shopping_list')
@@ -236,6 +282,12 @@ class FavoriteList(models.Model):
         verbose_name = _('Список избранных')
         verbose_name_plural = _('Списки избранных')
         ordering = ('-updated_at',)
+        indexes = (
+            models.Index(fields=('author', '-updated_at'),
+                         name='favorite_author_updated_idx'),
+            models.Index(fields=('updated_at', ),
+                         name='favorite_updated_idx'),
+        )
         constraints = [
             models.UniqueConstraint(fields=['author', 'recipe'],
                                     name='unique_favorite_list')
@@ -243,3 +295,161 @@ class FavoriteList(models.Model):
 
     def __str__(self):
         return f'{self.author} {self.recipe.name}'
+
+
+class PendingCounter(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='+',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        verbose_name=_('Рецепт'),
+        help_text=_('Рецепт, счетчики которого нужно пересчитать.'),
+    )
+
+    class Meta:
+        verbose_name = _('Отложенный пересчет счетчиков')
+        verbose_name_plural = _('Отложенные пересчеты счетчиков')
+
+    def __str__(self):
+        return f'{self.recipe_id}'
+
+
+class RecipeViewStat(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='view_stats',
+        on_delete=models.CASCADE,
+        verbose_name=_('Рецепт'),
+        help_text=_('Просмотренный рецепт.'),
+    )
+    hour = models.DateTimeField(
+        verbose_name=_('Час'),
+        help_text=_('Начало часа, за который собрана статистика.'),
+    )
+    views = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Просмотры'),
+        help_text=_('Количество открытий страницы рецепта.'),
+    )
+    impressions = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Показы'),
+        help_text=_('Количество показов рецепта в списках.'),
+    )
+
+    class Meta:
+        verbose_name = _('Статистика просмотров')
+        verbose_name_plural = _('Статистика просмотров')
+        ordering = ('-hour',)
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'hour'],
+                                    name='unique_recipe_view_stat')
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} {self.hour}'
+
+
+class RecipeNeighbour(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='neighbours',
+        on_delete=models.CASCADE,
+        verbose_name=_('Рецепт'),
+        help_text=_('Рецепт, для которого подобраны похожие.'),
+    )
+    neighbour = models.ForeignKey(
+        Recipe,
+        related_name='similar_to',
+        on_delete=models.CASCADE,
+        verbose_name=_('Похожий рецепт'),
+        help_text=_('Рецепт, который добавляют в избранное вместе с '
+                    'рецептом.'),
+    )
+    score = models.FloatField(
+        verbose_name=_('Сходство'),
+        help_text=_('Косинусная мера по пользователям, добавившим оба '
+                    'рецепта в избранное.'),
+    )
+
+    class Meta:
+        verbose_name = _('Похожий рецепт')
+        verbose_name_plural = _('Похожие рецепты')
+        ordering = ('recipe', '-score')
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'neighbour'],
+                                    name='unique_recipe_neighbour')
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} {self.neighbour_id}'
+
+
+class IngredientRelation(models.Model):
+    PAIR = 'pair'
+    SUBSTITUTE = 'substitute'
+    KINDS = (
+        (PAIR, _('Сочетается')),
+        (SUBSTITUTE, _('Заменяет')),
+    )
+
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='relations',
+        on_delete=models.CASCADE,
+        verbose_name=_('Ингредиент'),
+        help_text=_('Ингредиент, для которого подобраны связанные.'),
+    )
+    related = models.ForeignKey(
+        Ingredient,
+        related_name='related_to',
+        on_delete=models.CASCADE,
+        verbose_name=_('Связанный ингредиент'),
+        help_text=_('Ингредиент, который сочетается с ингредиентом или '
+                    'заменяет его.'),
+    )
+    kind = models.CharField(
+        max_length=10,
+        choices=KINDS,
+        verbose_name=_('Тип связи'),
+        help_text=_('Сочетание или замена.'),
+    )
+    score = models.FloatField(
+        verbose_name=_('Оценка'),
+        help_text=_('PMI для сочетаний, косинусная мера контекстов для '
+                    'замен.'),
+    )
+
+    class Meta:
+        verbose_name = _('Связь ингредиентов')
+        verbose_name_plural = _('Связи ингредиентов')
+        ordering = ('ingredient', 'kind', '-score')
+        constraints = [
+            models.UniqueConstraint(fields=['ingredient', 'kind', 'related'],
+                                    name='unique_ingredient_relation')
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient_id} {self.kind} {self.related_id}'
+
+
+class Watermark(models.Model):
+    name = models.CharField(
+        max_length=50,
+        unique=True,
+        verbose_name=_('Название'),
+        help_text=_('Название периодической задачи.'),
+    )
+    value = models.DateTimeField(
+        verbose_name=_('Значение'),
+        help_text=_('Время, до которого задача обработала данные.'),
+    )
+
+    class Meta:
+        verbose_name = _('Отметка обработки')
+        verbose_name_plural = _('Отметки обработки')
+
+    def __str__(self):
+        return f'{self.name} {self.value}'
@@ -1,5 +1,5 @@
 from rest_framework.permissions import (
-    SAFE_METHODS, BasePermission, IsAuthenticatedOrReadOnly,
+    SAFE_METHODS, BasePermission, IsAuthenticated, IsAuthenticatedOrReadOnly,
 )
 
 
@@ -24,3 +24,12 @@ class ActiveCurrentUserOrAdminOrReadOnly(IsAuthenticatedOrReadOnly):
             if (obj.author == user or user.is_staff) and user.is_active:
                 return True
         return request.method in SAFE_METHODS
+
+
+class ActiveAuthorOrAdmin(IsAuthenticated):
+    """ Данные автора, например статистика его рецептов: объект — автор.
+    """
+
+    def has_object_permission(self, request, view, obj):
+        user = request.user
+        return (obj == user or user.is_staff) and user.is_active
@@ -1,10 +1,14 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from users.models import Subscription
 from users.serializers import UserBaseSerializer
 
+from .fields import BulkPrimaryKeyRelatedField
 from .models import (
     FavoriteList, Ingredient, IngredientsAmount, Recipe, ShoppingCart, Tag,
 )
@@ -25,7 +29,7 @@ class IngredientSerializers(serializers.ModelSerializer):
 
 
 class IngredientAmountSerializers(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(
         write_only=True,
         min_value=1,
@@ -38,10 +42,10 @@ class IngredientAmountSerializers(serializers.ModelSerializer):
 
 
 class RecipeSerializers(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(),
-                                              many=True)
+    tags = BulkPrimaryKeyRelatedField(queryset=Tag.objects.all(), many=True)
     author = UserBaseSerializer(read_only=True)
-    ingredients = IngredientAmountSerializers(many=True)
+    ingredients = IngredientAmountSerializers(many=True,
+                                              source='ingredient_amounts')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
@@ -59,23 +63,45 @@ class RecipeSerializers(serializers.ModelSerializer):
             'image',
             'text',
             'cooking_time',
+            'favorites_count',
+            'cart_count',
         )
 
     def to_representation(self, instance):
+        """Теги и ингредиенты берутся из кэша prefetch_related, который
+        заполняет RecipeView. Для объекта, полученного не из queryset
+        представления (create), кэш заполняется здесь же.
+        """
+        prefetch_related_objects([instance], 'tags',
+                                 'ingredient_amounts__ingredient')
         rep = super().to_representation(instance)
         rep['tags'] = TagSerializers(instance.tags.all(), many=True).data
 
         rep['ingredients'] = [{
             **IngredientSerializers(x.ingredient).data,
             **{'amount': x.amount}
-        } for x in instance.ingredients.all().select_related('ingredient')]
+        } for x in instance.ingredient_amounts.all()]
         return rep
 
     def validate_ingredients(self, attrs) -> list:
+        """Все ингредиенты получаются одним запросом, ошибки по
+        несуществующим id возвращаются для каждого элемента списка.
+        """
         if self.context['request'].method != 'PATCH' and not attrs:
             raise serializers.ValidationError(
                 'At least one ingredient must be added.'
             )
+        objects = Ingredient.objects.in_bulk({x['id'] for x in attrs})
+        message = serializers.PrimaryKeyRelatedField.default_error_messages[
+            'does_not_exist']
+        errors = [
+            {} if x['id'] in objects
+            else {'id': [message.format(pk_value=x['id'])]}
+            for x in attrs
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors, code='does_not_exist')
+
         ingredients = {}
         for item in attrs:
             if ingredients.get(item.get('id')):
@@ -84,20 +110,22 @@ class RecipeSerializers(serializers.ModelSerializer):
                 ingredients[item.get('id')] = item.get('amount')
 
         return [
-            {'ingredient': ingredient, 'amount': amount}
-            for ingredient, amount in ingredients.items()
+            {'ingredient': objects[pk], 'amount': amount}
+            for pk, amount in ingredients.items()
         ]
 
+    @transaction.atomic
     def create(self, validated_data):
-        ingredients = validated_data.pop('ingredients')
+        ingredients = validated_data.pop('ingredient_amounts')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.add(*tags)
-        ingredients = [IngredientsAmount.objects.create(**x) for x in
-                       ingredients]
-        recipe.ingredients.add(*ingredients)
+        IngredientsAmount.objects.bulk_create(
+            IngredientsAmount(recipe=recipe, **x) for x in ingredients
+        )
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         self._update_ingredients()
         self._update_tags()
@@ -110,31 +138,61 @@ class RecipeSerializers(serializers.ModelSerializer):
         return instance
 
     def get_is_favorited(self, instance):
+        if hasattr(instance, 'is_favorited'):
+            return instance.is_favorited
         user = self.context['request'].user
         if user.is_anonymous:
             return False
         return instance.favorite_lists.filter(author=user).exists()
 
     def get_is_in_shopping_cart(self, instance):
+        if hasattr(instance, 'is_in_shopping_cart'):
+            return instance.is_in_shopping_cart
         user = self.context['request'].user
         if user.is_anonymous:
             return False
         return instance.shopping_lists.filter(author=user).exists()
 
     def _update_ingredients(self):
-        new_data_raw = self.validated_data.get('ingredients')
-        if new_data_raw:
-            self.instance.ingredients.all().delete()
-            ingredients = [
-                IngredientsAmount.objects.create(**x) for x in new_data_raw
-            ]
-            self.instance.ingredients.add(*ingredients)
+        """Сравнивает новые ингредиенты с текущими: удаляются только
+        исчезнувшие, создаются только добавленные, количество обновляется
+        только у изменившихся. Неизмененные строки не затрагиваются.
+        bulk_create и bulk_update не отправляют сигналы, индексы рецепта
+        пересчитывает сигнал сохранения рецепта в update.
+        """
+        new_data_raw = self.validated_data.get('ingredient_amounts')
+        if not new_data_raw:
+            return
+        new_data = {x['ingredient'].id: x for x in new_data_raw}
+        current = {
+            x.ingredient_id: x for x in self.instance.ingredient_amounts.all()
+        }
+        removed = current.keys() - new_data.keys()
+        if removed:
+            self.instance.ingredient_amounts.filter(
+                ingredient_id__in=removed).delete()
+
+        now = timezone.now()
+        to_create, to_update = [], []
+        for ingredient_id, item in new_data.items():
+            amount = current.get(ingredient_id)
+            if amount is None:
+                to_create.append(
+                    IngredientsAmount(recipe=self.instance, **item))
+            elif amount.amount != item['amount']:
+                amount.amount = item['amount']
+                amount.updated_at = now
+                to_update.append(amount)
+        if to_create:
+            IngredientsAmount.objects.bulk_create(to_create)
+        if to_update:
+            IngredientsAmount.objects.bulk_update(to_update,
+                                                  ('amount', 'updated_at'))
 
     def _update_tags(self):
         new_data_raw = self.validated_data.get('tags')
         if new_data_raw:
-            self.instance.tags.clear()
-            self.instance.tags.add(*self.validated_data['tags'])
+            self.instance.tags.set(new_data_raw)
 
 
 class RecipeShortSerializers(serializers.ModelSerializer):
@@ -144,23 +202,38 @@ class RecipeShortSerializers(serializers.ModelSerializer):
 
 
 class SubscriptionsSerializer(UserBaseSerializer):
-    recipes = RecipeShortSerializers(many=True, read_only=True)
+    recipes = serializers.SerializerMethodField()
 
     class Meta(UserBaseSerializer.Meta):
         model = User
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
-                  'is_subscribed', 'recipes')
+                  'is_subscribed', 'recipes', 'recipes_count',
+                  'followers_count')
         read_only_fields = ('email', 'username', 'first_name', 'last_name',
                             'is_subscribed')
 
-    def to_representation(self, instance):
-        rep = super().to_representation(instance)
-        rep['recipes_count'] = len(rep['recipes'])
-        recipes_limit = self.context['request'].query_params.get(
-            'recipes_limit')
-        if recipes_limit:
-            rep['recipes'] = rep['recipes'][:int(recipes_limit)]
-        return rep
+    def get_recipes(self, instance):
+        """Если рецепты уже загружены через prefetch_related (с учетом
+        recipes_limit), используются они, иначе лимит применяется в запросе.
+        """
+        recipes = instance.recipes.all()
+        if 'recipes' not in getattr(instance, '_prefetched_objects_cache', {}):
+            recipes_limit = self.get_recipes_limit(self.context['request'])
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
+        return RecipeShortSerializers(
+            recipes, many=True, context=self.context).data
+
+    @staticmethod
+    def get_recipes_limit(request):
+        """Значение параметра recipes_limit или None, если параметр
+        не передан или некорректен.
+        """
+        try:
+            recipes_limit = int(request.query_params.get('recipes_limit'))
+        except (TypeError, ValueError):
+            return None
+        return recipes_limit if recipes_limit >= 0 else None
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
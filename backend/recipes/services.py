@@ -1,67 +1,897 @@
-import mimetypes
-import os
+import csv
+import hashlib
+import heapq
+import math
+import re
+import tempfile
+import threading
 import uuid
 
-from django.conf import settings
-from django.http.response import HttpResponse
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from datetime import timedelta
+from itertools import combinations, groupby
+from operator import itemgetter
+
+from django.core.cache import cache
+from django.db import (
+    DatabaseError, close_old_connections, connection, transaction,
+)
+from django.db.models import (
+    Case, Count, F, FloatField, Max, OuterRef, Subquery, Sum, Value, When,
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from django.http.response import StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from users.models import Subscription, User
+from users.pagination import bump_count_version
+
+from .models import (
+    FavoriteList, Ingredient, IngredientRelation, IngredientsAmount,
+    PendingCounter, Recipe, RecipeNeighbour, RecipeViewStat, ShoppingCart, Tag,
+    Watermark,
+)
+
+RENDERERS = {}
+CATALOG_VERSION_KEY = 'catalog_version:{}'
+# (модель, поле счетчика, модель строк, поле строк со ссылкой на модель)
+COUNTERS = (
+    (Recipe, 'favorites_count', FavoriteList, 'recipe'),
+    (Recipe, 'cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'following'),
+)
+
+
+def count_subquery(model, field):
+    """:return: COUNT строк model, у которых field ссылается на OuterRef"""
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def register_renderer(cls):
+    """Регистрирует класс формата файла в RENDERERS по его extension."""
+    RENDERERS[cls.extension] = cls
+    return cls
+
+
+class BaseRenderer:
+    """ Базовый класс формата списка покупок.
+
+    Получает итератор строк (index, name, measurement_unit, amount) и
+    отдает содержимое файла частями, не собирая документ целиком.
+    """
+    extension = None
+    content_type = None
+    header = ('№', 'Ингредиент', 'Единица измерения', 'Количество')
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def render(self):
+        """:return: generator(str | bytes)"""
+        raise NotImplementedError
+
+
+@register_renderer
+class TxtRenderer(BaseRenderer):
+    extension = 'txt'
+    content_type = 'text/plain; charset=utf-8'
+
+    def render(self):
+        divided_line = f'\n{"<" * 20} FOODGRAM {">" * 20}\n'
+        yield f'Список покупок для рецептов{divided_line}\n'
+        for index, name, unit, amount in self.rows:
+            yield f'{index}. {name.capitalize()} ({unit}) — {amount}\n'
+        yield f'{divided_line}С любовью, команда FoodGram.'
+
+
+@register_renderer
+class CsvRenderer(BaseRenderer):
+    extension = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+
+    class Echo:
+        """Буфер для csv.writer, который возвращает записанную строку."""
+
+        def write(self, value):
+            return value
+
+    def render(self):
+        writer = csv.writer(self.Echo())
+        yield writer.writerow(self.header)
+        for row in self.rows:
+            yield writer.writerow(row)
+
+
+@register_renderer
+class XlsxRenderer(BaseRenderer):
+    """Книга строится в режиме write_only, строки листа openpyxl сразу
+    сбрасывает во временный файл. Готовый zip архив отдается из
+    SpooledTemporaryFile частями по chunk_size байт.
+    """
+    extension = 'xlsx'
+    content_type = ('application/vnd.openxmlformats-officedocument.'
+                    'spreadsheetml.sheet')
+    chunk_size = 64 * 1024
+
+    def render(self):
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Список покупок')
+        sheet.append(self.header)
+        for row in self.rows:
+            sheet.append(row)
+        with tempfile.SpooledTemporaryFile(max_size=self.chunk_size) as file:
+            workbook.save(file)
+            file.seek(0)
+            while chunk := file.read(self.chunk_size):
+                yield chunk
+
+
+class ShoppingListCache:
+    """ Кэш просуммированного списка покупок пользователя.
+
+    Версия списка вычисляется одним запросом по строкам ShoppingCart:
+    количество строк, последнее изменение листа и последнее изменение
+    рецептов из листа (updated_at рецепта обновляется при сохранении,
+    в том числе при изменении ингредиентов). В версию входит и версия
+    справочника ингредиентов из CatalogCache: переименование, смена
+    единицы измерения или удаление ингредиента не меняют строки листа.
+    Любое изменение листа, его рецептов или ингредиентов дает новую
+    версию, старые записи истекают по timeout.
+    """
+    key_prefix = 'shopping_list'
+    timeout = 60 * 60
+
+    def __init__(self, user):
+        self.user = user
+        self.version = self._get_version()
+
+    def _get_version(self) -> str:
+        probe = self.user.shopping_lists.aggregate(
+            count=Count('id'),
+            cart=Max('updated_at'),
+            recipes=Max('recipe__updated_at'),
+        )
+        raw = (f'{probe["count"]}:{probe["cart"]}:{probe["recipes"]}:'
+               f'{CatalogCache(Ingredient).version}')
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    def get_queryset(self):
+        return Ingredient.objects.filter(
+            recipe_ingredients__recipe__shopping_lists__author=self.user
+        ).values(
+            'name', 'measurement_unit'
+        ).annotate(
+            amount=Sum('recipe_ingredients__amount')
+        ).order_by('name')
+
+    def get_data(self) -> list:
+        """:return: list(dict(name, measurement_unit, amount))"""
+        key = f'{self.key_prefix}:{self.user.id}:{self.version}'
+        data = cache.get(key)
+        if data is None:
+            data = list(self.get_queryset())
+            cache.set(key, data, self.timeout)
+        return data
+
+
+class CatalogCache:
+    """ Кэш готовых JSON ответов справочника (теги, ингредиенты).
+
+    Версия справочника хранится в общем кэше и меняется сигналами при
+    сохранении и удалении объектов модели. Ответы хранятся под версией в
+    общем кэше и в памяти процесса, поэтому в установившемся режиме ответ
+    отдается без запросов к базе: версия из общего кэша, байты из памяти.
+    """
+    key_prefix = 'catalog'
+    timeout = 24 * 60 * 60
+    local = {}
+
+    def __init__(self, model):
+        self.label = model._meta.label_lower
+        self.version = cache.get_or_set(
+            CATALOG_VERSION_KEY.format(self.label), uuid.uuid4().hex, None)
+
+    @staticmethod
+    def bump(model):
+        cache.set(CATALOG_VERSION_KEY.format(model._meta.label_lower),
+                  uuid.uuid4().hex, None)
+
+    def get(self, name):
+        """:return: None | bytes"""
+        local = self.local.get((self.label, name))
+        if local is not None and local[0] == self.version:
+            return local[1]
+        content = cache.get(self._get_key(name))
+        if content is not None:
+            self.local[(self.label, name)] = (self.version, content)
+        return content
+
+    def set(self, name, content: bytes):
+        self.local[(self.label, name)] = (self.version, content)
+        cache.set(self._get_key(name), content, self.timeout)
+
+    def _get_key(self, name) -> str:
+        return f'{self.key_prefix}:{self.label}:{self.version}:{name}'
+
+
+class CounterBuffer:
+    """ Отложенная запись счетчиков избранного и списков покупок.
+
+    Добавление в избранное или список покупок не трогает строку рецепта:
+    в той же транзакции id рецепта добавляется в журнал PendingCounter.
+    Журнал только дополняется, поэтому частые переключения не ждут друг
+    друга ни на строке рецепта, ни на уникальном ключе. У журнала нет
+    внешнего ключа в базе: запись может ссылаться на рецепт, удаленный в
+    той же транзакции.
+
+    flush пересчитывает счетчики рецептов из журнала по таблицам
+    FavoriteList и ShoppingCart одним UPDATE на пачку и в той же
+    транзакции удаляет прочитанные записи журнала. Сброс обрабатывает
+    записи, добавленные до его начала, а запись, закоммиченная во время
+    сброса, остается в журнале до следующего, поэтому рецепт не теряется
+    ни при гонке, ни при сбое.
+    """
+    batch_size = 500
+
+    def add(self, recipe_id):
+        PendingCounter.objects.create(recipe_id=recipe_id)
+
+    def flush(self) -> int:
+        """Пересчитывает рецепты из журнала пачками по batch_size записей.
+        :return: количество пересчитанных рецептов
+        """
+        last = PendingCounter.objects.aggregate(last=Max('id'))['last']
+        journal = PendingCounter.objects.filter(id__lte=last or 0)
+        recounted = set()
+        while True:
+            with transaction.atomic():
+                rows = list(journal.order_by('id').values_list(
+                    'id', 'recipe_id')[:self.batch_size])
+                if not rows:
+                    break
+                ids, recipe_ids = zip(*rows)
+                self.recount(set(recipe_ids))
+                PendingCounter.objects.filter(id__in=ids).delete()
+            recounted.update(recipe_ids)
+        if recounted:
+            bump_count_version(Recipe)
+        return len(recounted)
+
+    @staticmethod
+    def recount(recipe_ids):
+        Recipe.objects.filter(id__in=recipe_ids).update(**{
+            field: count_subquery(source, source_field)
+            for model, field, source, source_field in COUNTERS
+            if model is Recipe
+        })
+
+
+class ViewTracker:
+    """ Учет просмотров и показов рецептов без записи в строку рецепта.
+
+    События копятся в кольцевом буфере процесса, при переполнении
+    вытесняются самые старые. Запрос только добавляет события в буфер, в
+    почасовую таблицу RecipeViewStat их сбрасывает фоновый поток процесса,
+    запущенный start: одним executemany с INSERT ... ON CONFLICT каждые
+    flush_interval секунд или раньше, когда в буфере набирается flush_size
+    событий, и при завершении процесса.
+    """
+    size = 10000
+    flush_size = 1000
+    flush_interval = 60
+    buffer = deque(maxlen=size)
+    flush_requested = threading.Event()
+    flusher = None
+    sql = (
+        'INSERT INTO {table} (recipe_id, hour, views, impressions) '
+        'SELECT id, %s, %s, %s FROM {recipes} WHERE id = %s '
+        'ON CONFLICT (recipe_id, hour) DO UPDATE SET '
+        'views = {table}.views + excluded.views, '
+        'impressions = {table}.impressions + excluded.impressions'
+    )
+
+    @classmethod
+    def record(cls, recipe_ids, kind):
+        """:param kind: 'views' | 'impressions'"""
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        cls.buffer.extend((recipe_id, hour, kind) for recipe_id in recipe_ids)
+        if len(cls.buffer) >= cls.flush_size:
+            cls.flush_requested.set()
+
+    @classmethod
+    def start(cls):
+        """Запускает фоновый сброс буфера. Вызывается в процессах сервера
+        из wsgi, команды и тесты вызывают flush сами.
+        """
+        if cls.flusher is None or not cls.flusher.is_alive():
+            cls.flusher = threading.Thread(target=cls.flush_periodically,
+                                           name='view-tracker', daemon=True)
+            cls.flusher.start()
+
+    @classmethod
+    def flush_periodically(cls):
+        """События пачки, которую не удалось записать, теряются, как и при
+        недоступной базе на выходе из процесса.
+        """
+        while True:
+            cls.flush_requested.wait(cls.flush_interval)
+            cls.flush_requested.clear()
+            close_old_connections()
+            try:
+                cls.flush()
+            except DatabaseError:
+                pass
+
+    @classmethod
+    def flush(cls) -> int:
+        """Строки удаленных к моменту сброса рецептов пропускаются.
+        :return: количество строк (рецепт, час)
+        """
+        rows = defaultdict(lambda: {'views': 0, 'impressions': 0})
+        for _ in range(len(cls.buffer)):
+            try:
+                recipe_id, hour, kind = cls.buffer.popleft()
+            except IndexError:
+                break
+            rows[recipe_id, hour][kind] += 1
+        if not rows:
+            return 0
+        sql = cls.sql.format(table=RecipeViewStat._meta.db_table,
+                             recipes=Recipe._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                (connection.ops.adapt_datetimefield_value(hour),
+                 counts['views'], counts['impressions'], recipe_id)
+                for (recipe_id, hour), counts in rows.items()
+            ])
+        return len(rows)
+
+    @classmethod
+    def flush_on_exit(cls):
+        """Недоступная при остановке база не должна мешать завершению
+        процесса, несброшенные события в этом случае теряются.
+        """
+        try:
+            cls.flush()
+        except DatabaseError:
+            pass
+
+
+class TrendingScore:
+    """ Популярность рецептов Recipe.trending_score.
+
+    Каждое добавление в избранное или список покупок дает вклад
+    weight * 2 ** (-(now - updated_at) / half_life). Общий множитель
+    2 ** (-(now - epoch) / half_life) не меняет порядок рецептов, поэтому
+    в поле хранится сумма weight * 2 ** ((updated_at - epoch) / half_life),
+    и refresh только прибавляет вклады строк, добавленных после отметки
+    Watermark, не пересчитывая старые. Когда epoch отстает больше чем на
+    rebase_after, все значения умножаются на общий множитель и epoch
+    сдвигается, чтобы числа не росли неограниченно. Строки моложе lag не
+    обрабатываются, чтобы не пропустить еще не закоммиченные записи.
+    Удаление из избранного вклад не отменяет, он затухает со временем.
+    """
+    sources = ((FavoriteList, 1.0), (ShoppingCart, 0.5))
+    half_life = timedelta(days=1)
+    lag = timedelta(minutes=1)
+    rebase_after = timedelta(days=30)
+    batch_size = 500
+    watermark_name = 'trending'
+    epoch_name = 'trending_epoch'
+
+    def refresh(self) -> int:
+        """:return: количество рецептов с новым вкладом"""
+        until = timezone.now() - self.lag
+        with transaction.atomic():
+            watermark = Watermark.objects.select_for_update().filter(
+                name=self.watermark_name).first()
+            epoch = Watermark.objects.select_for_update().get_or_create(
+                name=self.epoch_name, defaults={'value': until})[0]
+            if until - epoch.value > self.rebase_after:
+                Recipe.objects.filter(trending_score__gt=0).update(
+                    trending_score=F('trending_score') * self._decay(
+                        epoch.value, until))
+                epoch.value = until
+                epoch.save()
+            scores = defaultdict(float)
+            for model, weight in self.sources:
+                rows = model.objects.filter(updated_at__lte=until)
+                if watermark is not None:
+                    rows = rows.filter(updated_at__gt=watermark.value)
+                for recipe_id, updated_at in rows.values_list(
+                        'recipe_id', 'updated_at').iterator():
+                    scores[recipe_id] += weight / self._decay(
+                        epoch.value, updated_at)
+            items = sorted(scores.items())
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                Recipe.objects.filter(pk__in=[x[0] for x in batch]).update(
+                    trending_score=F('trending_score') + Case(
+                        *[When(pk=pk, then=Value(score))
+                          for pk, score in batch],
+                        output_field=FloatField(),
+                    ))
+            Watermark.objects.update_or_create(
+                name=self.watermark_name, defaults={'value': until})
+        if items:
+            bump_count_version(Recipe)
+        return len(items)
+
+    def _decay(self, start, end) -> float:
+        """:return: во сколько раз вклад уменьшается от start до end"""
+        return math.pow(2, -(end - start) / self.half_life)
+
+
+class SimilarRecipes:
+    """ Похожие рецепты по совместному добавлению в избранное.
+
+    Матрица пользователь x рецепт загружается одним запросом в виде
+    разреженных списков: рецепты пользователя и пользователи рецепта.
+    Для каждого рецепта пересечения с остальными считаются обходом его
+    пользователей, сходство - косинусная мера
+    common / sqrt(users_a * users_b), в RecipeNeighbour сохраняются
+    top_k лучших. У пользователя учитываются max_user_favorites последних
+    рецептов, чтобы большие списки избранного не давали квадратичный
+    рост работы. Таблица перестраивается целиком в одной транзакции,
+    поэтому читатели видят старые соседи до ее завершения.
+    """
+    top_k = 20
+    max_user_favorites = 500
+    batch_size = 1000
+
+    def build(self) -> int:
+        """:return: количество сохраненных пар"""
+        user_recipes = defaultdict(list)
+        recipe_users = defaultdict(list)
+        for author_id, recipe_id in FavoriteList.objects.order_by(
+                'author_id', '-updated_at', '-id'
+        ).values_list('author_id', 'recipe_id').iterator():
+            if len(user_recipes[author_id]) < self.max_user_favorites:
+                user_recipes[author_id].append(recipe_id)
+                recipe_users[recipe_id].append(author_id)
+        recipe_ids = sorted(recipe_users)
+        saved = 0
+        with transaction.atomic():
+            RecipeNeighbour.objects.all().delete()
+            for start in range(0, len(recipe_ids), self.batch_size):
+                neighbours = [
+                    RecipeNeighbour(recipe_id=recipe_id, neighbour_id=other,
+                                    score=score)
+                    for recipe_id in recipe_ids[start:start + self.batch_size]
+                    for score, other in self.get_neighbours(
+                        recipe_id, user_recipes, recipe_users)
+                ]
+                RecipeNeighbour.objects.bulk_create(neighbours)
+                saved += len(neighbours)
+        return saved
+
+    def get_neighbours(self, recipe_id, user_recipes, recipe_users) -> list:
+        """:return: list(tuple(score, recipe_id)) по убыванию score"""
+        common = Counter()
+        for user_id in recipe_users[recipe_id]:
+            common.update(user_recipes[user_id])
+        del common[recipe_id]
+        size = len(recipe_users[recipe_id])
+        return heapq.nlargest(self.top_k, (
+            (count / math.sqrt(size * len(recipe_users[other])), other)
+            for other, count in common.items()
+        ))
+
+
+class IngredientRelations:
+    """ Сочетания и замены ингредиентов по составу рецептов.
+
+    Частоты ингредиентов и их пар считаются за один проход по
+    IngredientsAmount. Сочетания оцениваются PMI
+    log(n_ab * N / (n_a * n_b)) по парам, встретившимся не реже min_count
+    раз, отрицательные PMI отбрасываются. Заменами считаются ингредиенты
+    с похожими сочетаниями, которые сами вместе почти не встречаются:
+    косинусная мера векторов PMI. Для каждого ингредиента сохраняются
+    top_k лучших связей каждого типа, таблица перестраивается в одной
+    транзакции.
+    """
+    top_k = 20
+    min_count = 2
+    batch_size = 1000
+
+    def build(self) -> int:
+        """:return: количество сохраненных связей"""
+        frequency = Counter()
+        pairs = Counter()
+        total = 0
+        rows = IngredientsAmount.objects.order_by('recipe_id').values_list(
+            'recipe_id', 'ingredient_id').iterator()
+        for _, recipe_rows in groupby(rows, key=itemgetter(0)):
+            ingredient_ids = sorted({x[1] for x in recipe_rows})
+            frequency.update(ingredient_ids)
+            pairs.update(combinations(ingredient_ids, 2))
+            total += 1
+        contexts = defaultdict(dict)
+        for (first, second), count in pairs.items():
+            if count < self.min_count:
+                continue
+            pmi = math.log(count * total / (frequency[first]
+                                            * frequency[second]))
+            if pmi > 0:
+                contexts[first][second] = contexts[second][first] = pmi
+        norms = {
+            ingredient_id: math.sqrt(sum(x * x for x in context.values()))
+            for ingredient_id, context in contexts.items()
+        }
+        relations = []
+        for ingredient_id, context in contexts.items():
+            for kind, related in (
+                (IngredientRelation.PAIR, heapq.nlargest(
+                    self.top_k, ((x, y) for y, x in context.items()))),
+                (IngredientRelation.SUBSTITUTE, self.get_substitutes(
+                    ingredient_id, contexts, norms)),
+            ):
+                relations += [
+                    IngredientRelation(ingredient_id=ingredient_id,
+                                       related_id=related_id, kind=kind,
+                                       score=score)
+                    for score, related_id in related
+                ]
+        with transaction.atomic():
+            IngredientRelation.objects.all().delete()
+            IngredientRelation.objects.bulk_create(
+                relations, batch_size=self.batch_size)
+        return len(relations)
+
+    def get_substitutes(self, ingredient_id, contexts, norms) -> list:
+        """Кандидаты - ингредиенты с общими сочетаниями, которые не входят
+        в сочетания самого ингредиента.
+        :return: list(tuple(score, ingredient_id)) по убыванию score
+        """
+        context = contexts[ingredient_id]
+        dots = Counter()
+        for other, weight in context.items():
+            for candidate, candidate_weight in contexts[other].items():
+                dots[candidate] += weight * candidate_weight
+        return heapq.nlargest(self.top_k, (
+            (dot / (norms[ingredient_id] * norms[candidate]), candidate)
+            for candidate, dot in dots.items()
+            if candidate != ingredient_id and candidate not in context
+        ))
+
+
+class CatalogIndex:
+    """ Базовый класс структуры данных справочника в памяти процесса.
+
+    Структура строится методом build и перестраивается при смене версии
+    справочника model в CatalogCache, поэтому get в установившемся режиме
+    не обращается к базе.
+    """
+    model = None
+    instance = None
+
+    def __init__(self, version):
+        self.version = version
+        self.build()
+
+    def build(self):
+        raise NotImplementedError
+
+    @classmethod
+    def get(cls):
+        version = CatalogCache(cls.model).version
+        if cls.instance is None or cls.instance.version != version:
+            cls.instance = cls(version)
+        return cls.instance
+
+
+class TagMap(CatalogIndex):
+    """Соответствие slug → id тегов."""
+    model = Tag
+
+    def build(self):
+        self.ids = dict(Tag.objects.values_list('slug', 'id'))
+
+
+class IngredientIndex(CatalogIndex):
+    """ Отсортированный индекс названий ингредиентов для автодополнения.
+
+    Начало названия ищется бинарным поиском по отсортированным названиям,
+    подстрока — проходом по названиям только если совпадений по началу
+    меньше limit.
+    """
+    model = Ingredient
+
+    def build(self):
+        rows = Ingredient.objects.values('id', 'name', 'measurement_unit')
+        self.items = sorted(
+            ((x['name'].lower(), x) for x in rows),
+            key=lambda x: (x[0], x[1]['id'])
+        )
+        self.keys = [key for key, _ in self.items]
+
+    def search(self, query, limit) -> list:
+        """Сначала точное совпадение, затем совпадения по началу названия,
+        затем по подстроке (раньше вхождение — выше).
+        :return: list(dict(id, name, measurement_unit))
+        """
+        query = query.strip().lower()
+        if not query or limit <= 0:
+            return []
+        start = bisect_left(self.keys, query)
+        end = bisect_left(self.keys, query + chr(0x10FFFF), start)
+        result = [item for _, item in self.items[start:min(end,
+                                                           start + limit)]]
+        if len(result) < limit:
+            substring = (
+                (key.find(query), key, item['id'], item)
+                for key, item in self.items
+                if query in key and not key.startswith(query)
+            )
+            result += [x[3] for x in heapq.nsmallest(
+                limit - len(result), substring, key=lambda x: x[:3])]
+        return result
+
+
+class RecipeSearch:
+    """ Полнотекстовый поиск рецептов по названию, описанию и ингредиентам.
+
+    Документы рецептов хранятся в таблице table, которую создает миграция:
+    на PostgreSQL это tsvector с GIN индексом, на SQLite — виртуальная
+    таблица FTS5. Ключ документа — id рецепта (rowid для FTS5). Документы
+    обновляются сигналами recipes.signals.
+    """
+    table = 'recipes_recipe_search'
+    config = 'russian'
+    weights = {'name': 'A', 'text': 'B', 'ingredients': 'C'}
+    fts_weights = (10.0, 5.0, 1.0)
+    batch_size = 500
+
+    def __init__(self):
+        self.vendor = connection.vendor
+
+    def _documents_sql(self, count):
+        """SELECT id, name, text, ingredients для count рецептов"""
+        aggregate = ('string_agg' if self.vendor == 'postgresql'
+                     else 'group_concat')
+        return (
+            f"SELECT r.id, r.name, r.text, coalesce({aggregate}(i.name, ' '), "
+            f"'') "
+            f'FROM {Recipe._meta.db_table} r '
+            f'LEFT JOIN {IngredientsAmount._meta.db_table} a '
+            f'ON a.recipe_id = r.id '
+            f'LEFT JOIN {Ingredient._meta.db_table} i '
+            f'ON i.id = a.ingredient_id '
+            f'WHERE r.id IN ({", ".join(["%s"] * count)}) '
+            f'GROUP BY r.id, r.name, r.text'
+        )
+
+    def update(self, recipe_ids):
+        """Пересчитывает документы рецептов, по запросу на batch_size
+        рецептов.
+        """
+        recipe_ids = list(recipe_ids)
+        for start in range(0, len(recipe_ids), self.batch_size):
+            self._update(tuple(recipe_ids[start:start + self.batch_size]))
+
+    def _update(self, recipe_ids):
+        with connection.cursor() as cursor:
+            if self.vendor == 'postgresql':
+                document = ' || '.join(
+                    f"setweight(to_tsvector(%s::regconfig, d.{field}), "
+                    f"'{weight}')"
+                    for field, weight in self.weights.items()
+                )
+                cursor.execute(
+                    f'INSERT INTO {self.table} (recipe_id, document) '
+                    f'SELECT d.id, {document} FROM ('
+                    f'{self._documents_sql(len(recipe_ids))}'
+                    f') d (id, name, text, ingredients) '
+                    f'ON CONFLICT (recipe_id) '
+                    f'DO UPDATE SET document = EXCLUDED.document',
+                    [self.config] * len(self.weights) + list(recipe_ids)
+                )
+            else:
+                self._delete(cursor, recipe_ids)
+                cursor.execute(
+                    f'INSERT INTO {self.table} '
+                    f'(rowid, name, text, ingredients) '
+                    f'{self._documents_sql(len(recipe_ids))}',
+                    recipe_ids
+                )
+
+    def remove(self, recipe_ids):
+        recipe_ids = tuple(recipe_ids)
+        if recipe_ids:
+            with connection.cursor() as cursor:
+                self._delete(cursor, recipe_ids)
+
+    def _delete(self, cursor, recipe_ids):
+        key = 'recipe_id' if self.vendor == 'postgresql' else 'rowid'
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        cursor.execute(
+            f'DELETE FROM {self.table} WHERE {key} IN ({placeholders})',
+            recipe_ids)
+
+    def filter(self, queryset, query):
+        """Оставляет рецепты, подходящие под query, и сортирует их по
+        релевантности search_rank. Ранг имеет тип float8, чтобы значение из
+        курсора совпадало с пересчитанным в запросе следующей страницы.
+        """
+        if self.vendor == 'postgresql':
+            match = 'document @@ websearch_to_tsquery(%s::regconfig, %s)'
+            params = [self.config, query]
+            ids = RawSQL(
+                f'SELECT recipe_id FROM {self.table} WHERE {match}', params)
+            rank = RawSQL(
+                f'SELECT ts_rank(document, '
+                f'websearch_to_tsquery(%s::regconfig, %s))::float8 '
+                f'FROM {self.table} '
+                f'WHERE recipe_id = {Recipe._meta.db_table}.id', params,
+                output_field=FloatField())
+        else:
+            words = re.findall(r'\w+', query)
+            if not words:
+                return queryset.none()
+            params = [' '.join(f'"{word}"*' for word in words)]
+            ids = RawSQL(
+                f'SELECT rowid FROM {self.table} '
+                f'WHERE {self.table} MATCH %s', params)
+            weights = ', '.join(str(x) for x in self.fts_weights)
+            rank = RawSQL(
+                f'SELECT -bm25({self.table}, {weights}) FROM {self.table} '
+                f'WHERE {self.table} MATCH %s '
+                f'AND rowid = {Recipe._meta.db_table}.id', params,
+                output_field=FloatField())
+        return queryset.filter(id__in=ids).annotate(
+            search_rank=rank
+        ).order_by('-search_rank', '-updated_at', '-id')
+
+
+class RecipeIngredientSet:
+    """ Индекс множеств ингредиентов рецептов для фильтра «что приготовить».
+
+    Таблица table (создается миграцией) хранит для каждого рецепта
+    отсортированные id ингредиентов и их количество: на PostgreSQL это
+    bigint[] с GIN индексом для операторов @> и &&, на SQLite — строка
+    вида ',1,5,9,' с проверкой через LIKE. Строки обновляются сигналами
+    recipes.signals вместе с документами RecipeSearch.
+    """
+    table = 'recipes_recipe_ingredient_set'
+    batch_size = 500
+
+    def __init__(self):
+        self.vendor = connection.vendor
+
+    def update(self, recipe_ids):
+        """Пересчитывает множества ингредиентов, по запросу на batch_size
+        рецептов.
+        """
+        recipe_ids = list(recipe_ids)
+        for start in range(0, len(recipe_ids), self.batch_size):
+            self._update(tuple(recipe_ids[start:start + self.batch_size]))
+
+    def _update(self, recipe_ids):
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        source = (
+            f'FROM {Recipe._meta.db_table} r '
+            f'LEFT JOIN {IngredientsAmount._meta.db_table} a '
+            f'ON a.recipe_id = r.id '
+            f'WHERE r.id IN ({placeholders}) GROUP BY r.id'
+        )
+        with connection.cursor() as cursor:
+            if self.vendor == 'postgresql':
+                cursor.execute(
+                    f"INSERT INTO {self.table} "
+                    f"(recipe_id, ingredient_ids, ingredient_count) "
+                    f"SELECT r.id, coalesce(array_agg(a.ingredient_id "
+                    f"ORDER BY a.ingredient_id) FILTER "
+                    f"(WHERE a.ingredient_id IS NOT NULL), '{{}}'), "
+                    f"count(a.ingredient_id) {source} "
+                    f"ON CONFLICT (recipe_id) DO UPDATE SET "
+                    f"ingredient_ids = EXCLUDED.ingredient_ids, "
+                    f"ingredient_count = EXCLUDED.ingredient_count",
+                    recipe_ids
+                )
+            else:
+                self._delete(cursor, recipe_ids)
+                cursor.execute(
+                    f"INSERT INTO {self.table} "
+                    f"(recipe_id, ingredient_ids, ingredient_count) "
+                    f"SELECT r.id, "
+                    f"coalesce(',' || group_concat(a.ingredient_id, ',') "
+                    f"|| ',', ','), count(a.ingredient_id) {source}",
+                    recipe_ids
+                )
+
+    def remove(self, recipe_ids):
+        recipe_ids = tuple(recipe_ids)
+        if recipe_ids:
+            with connection.cursor() as cursor:
+                self._delete(cursor, recipe_ids)
+
+    def _delete(self, cursor, recipe_ids):
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        cursor.execute(
+            f'DELETE FROM {self.table} WHERE recipe_id IN ({placeholders})',
+            recipe_ids)
+
+    def _select(self, ingredient_ids, operator):
+        """SELECT recipe_id рецептов, содержащих все (operator='AND') или
+        хотя бы один (operator='OR') из ingredient_ids.
+        """
+        if self.vendor == 'postgresql':
+            lookup = '@>' if operator == 'AND' else '&&'
+            return RawSQL(
+                f'SELECT recipe_id FROM {self.table} '
+                f'WHERE ingredient_ids {lookup} %s::bigint[]',
+                [ingredient_ids])
+        condition = f' {operator} '.join(
+            ['ingredient_ids LIKE %s'] * len(ingredient_ids))
+        return RawSQL(
+            f'SELECT recipe_id FROM {self.table} WHERE {condition}',
+            [f'%,{x},%' for x in ingredient_ids])
+
+    def filter(self, queryset, include=(), exclude=()):
+        """Оставляет рецепты со всеми ингредиентами include и без
+        ингредиентов exclude. Если передан include, рецепты сортируются по
+        coverage — доле ингредиентов рецепта, попавших в include, типа
+        float8, а не numeric, чтобы значение можно было сохранить в курсоре.
+        """
+        include = sorted({int(x) for x in include})
+        exclude = sorted({int(x) for x in exclude})
+        if exclude:
+            queryset = queryset.exclude(
+                id__in=self._select(exclude, 'OR'))
+        if not include:
+            return queryset
+        coverage = RawSQL(
+            f'SELECT CAST(%s AS DOUBLE PRECISION) / ingredient_count '
+            f'FROM {self.table} WHERE recipe_id = {Recipe._meta.db_table}.id',
+            [len(include)], output_field=FloatField())
+        return queryset.filter(
+            id__in=self._select(include, 'AND')
+        ).annotate(
+            coverage=coverage
+        ).order_by('-coverage', '-updated_at', '-id')
 
 
 class DownloadList:
-    """ Преобразует queryset в string для последующего
-    формирования отчета.
+    """ Формирует отчет из уже просуммированного количества ингредиентов.
 
-    Поддерживает вывод только в txt файл.
+    Формат файла выбирается из зарегистрированных в RENDERERS.
     """
+    filename = 'shopping_list'
+
+    def __init__(self, data, file_format='txt'):
+        """
+        :param data: iterable(dict(name, measurement_unit, amount))
+        :param file_format: ключ из RENDERERS
+        """
+        self.data = data
+        self.renderer = RENDERERS[file_format]
 
-    def __init__(self, queryset):
-        self.queryset = queryset
-        self.data = self._get_data_from_queryset()
-
-    def _get_data_from_queryset(self) -> dict:
-        """Создается словарь с уникальными ингредиентами и суммой их
-        количества.
-        :return: dict(name(dict(amount, unit)))
-        """
-        ingredients = {}
-        for name, unit, amount in self.queryset:
-            if all((name, unit, amount,)):
-                if ingredients.get(name):
-                    ingredients[name]['amount'] += amount
-                else:
-                    ingredients[name] = {'amount': amount, 'unit': unit}
-        return ingredients
-
-    def make_txt_file(self):
-        """Создает файл txt по пути MEDIA_ROOT и наполняет его
-        из self.data.
-        :return: tuple(filename(str), filepath(str), mime_type(str))
-        """
-        filename = str(uuid.uuid4()) + '.txt'
-        filepath = os.path.join(settings.MEDIA_ROOT, filename)
-        with open(filepath, 'w') as file:
-            divided_line = f'\n{"<" * 20} FOODGRAM {">" * 20}\n'
-            file.write(f'Список покупок для рецептов{divided_line}\n')
-            for index, (name, payload) in enumerate(self.data.items(), 1):
-                file.write(f'{index}. {name.capitalize()} ({payload["unit"]})'
-                           f' — {int(payload["amount"])}\n')
-            file.write(f'{divided_line}С любовью, команда FoodGram.')
-
-        mime_type, _ = mimetypes.guess_type(filepath)
-        return filename, filepath, mime_type
+    def get_rows(self):
+        """:return: generator(tuple(index, name, measurement_unit, amount))
+        """
+        for index, item in enumerate(self.data, 1):
+            yield (index, item['name'], item['measurement_unit'],
+                   int(item['amount']))
 
     def download_file(self):
-        """Подготавливается HttpResponse, context наполняется из ранее
-        созданного файла. Передаются заголовки attachment.
-        После формирования HttpResponse подготовленный файл удаляется.
-        :return: HttpResponse
-        """
-        filename, path, mime_type = self.make_txt_file()
-        response = HttpResponse(open(path).readlines(), content_type=mime_type)
-        response['Content-Disposition'] = "attachment; filename=%s" % filename
-        self._delete_file(path)
+        """Подготавливается StreamingHttpResponse, содержимое файла
+        формируется на лету без сохранения на диск. Передаются заголовки
+        attachment.
+        :return: StreamingHttpResponse
+        """
+        renderer = self.renderer(self.get_rows())
+        response = StreamingHttpResponse(renderer.render(),
+                                         content_type=renderer.content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename={self.filename}.{renderer.extension}'
+        )
         return response
-
-    @staticmethod
-    def _delete_file(path):
-        if os.path.isfile(path):
-            os.remove(path)
@@ -0,0 +1,104 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from users.pagination import bump_count_version
+
+from .models import (
+    FavoriteList, Ingredient, IngredientsAmount, Recipe, ShoppingCart, Tag,
+)
+from .services import (
+    CatalogCache, CounterBuffer, RecipeIngredientSet, RecipeSearch,
+)
+
+User = get_user_model()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=FavoriteList)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def reset_recipes_count(sender, **kwargs):
+    bump_count_version(sender)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def reset_recipes_count_on_tags(sender, **kwargs):
+    bump_count_version(Recipe)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def reset_catalog_cache(sender, **kwargs):
+    """Версия меняется после коммита, иначе параллельный запрос может
+    собрать справочник из старых данных и сохранить его под новой версией.
+    """
+    def bump():
+        CatalogCache.bump(sender)
+        bump_count_version(sender)
+
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_indexes(sender, instance, **kwargs):
+    """Документ поиска и множество ингредиентов пересчитываются после
+    коммита, когда ингредиенты рецепта уже записаны.
+    """
+    def update():
+        RecipeSearch().update([instance.id])
+        RecipeIngredientSet().update([instance.id])
+
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_indexes(sender, instance, **kwargs):
+    RecipeSearch().remove([instance.id])
+    RecipeIngredientSet().remove([instance.id])
+
+
+@receiver((post_save, post_delete), sender=IngredientsAmount)
+def update_ingredient_indexes(sender, instance, **kwargs):
+    """Ингредиенты рецепта меняются и без сохранения рецепта: правка в
+    админке, каскадное удаление ингредиента.
+    """
+    recipe_id = instance.recipe_id
+
+    def update():
+        RecipeSearch().update([recipe_id])
+        RecipeIngredientSet().update([recipe_id])
+
+    transaction.on_commit(update)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_search_documents(sender, instance, created, **kwargs):
+    if created:
+        return
+    recipe_ids = list(instance.recipes.values_list('id', flat=True))
+    transaction.on_commit(lambda: RecipeSearch().update(recipe_ids))
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=Greatest(F('recipes_count') - 1, 0))
+
+
+@receiver((post_save, post_delete), sender=FavoriteList)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def buffer_recipe_counters(sender, instance, **kwargs):
+    """Счетчики рецепта пересчитывает CounterBuffer.flush, чтобы частые
+    переключения не блокировали строку рецепта. Запись журнала
+    добавляется в транзакции изменения и откатывается вместе с ним.
+    """
+    CounterBuffer().add(instance.recipe_id)
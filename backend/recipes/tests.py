@@ -1,6 +1,1137 @@
-# todo: TagTest(TestCase):
-# todo: IngredientTest(TestCase):
-# todo: RecipeTest(TestCase):
-# todo: ShoppingCartTest(TestCase):
-# todo: FavoriteListTest(TestCase):
-# todo: PermissionsRecipesTest(TestCase):
+import base64
+import io
+import json
+import re
+
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import load_workbook
+from rest_framework.test import APIClient
+from users.models import Subscription
+from users.pagination import COUNT_VERSION_KEY
+
+from .models import (
+    FavoriteList, Ingredient, IngredientsAmount, PendingCounter, Recipe,
+    ShoppingCart, Tag, Watermark,
+)
+from .services import (
+    CounterBuffer, RecipeIngredientSet, RecipeSearch, TrendingScore,
+    ViewTracker,
+)
+
+
+class RecipeTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.user = get_user_model().objects.create(
+            email='cook@test.com',
+            username='cook',
+            first_name='cook',
+            last_name='cook',
+            password='12cook',
+        )
+        cls.reader = get_user_model().objects.create(
+            email='reader@test.com',
+            username='reader',
+            first_name='reader',
+            last_name='reader',
+            password='12reader',
+        )
+        cls.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                     slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(name='соль',
+                                                   measurement_unit='г')
+        cls.recipes = [cls.create_recipe(f'recipe {x}') for x in range(3)]
+        FavoriteList.objects.create(author=cls.reader, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(author=cls.reader, recipe=cls.recipes[1])
+        CounterBuffer().flush()
+
+    @classmethod
+    def create_recipe(cls, name):
+        recipe = Recipe.objects.create(
+            author=cls.user,
+            name=name,
+            text='text',
+            cooking_time=10,
+            image='recipes/images/test.png',
+        )
+        recipe.tags.add(cls.tag)
+        IngredientsAmount.objects.create(recipe=recipe,
+                                         ingredient=cls.ingredient, amount=5)
+        return recipe
+
+    def setUp(self) -> None:
+        cache.clear()
+        ViewTracker.buffer.clear()
+        ViewTracker.flush_requested.clear()
+        self.client = APIClient()
+        self.reader_client = APIClient()
+        self.reader_client.force_authenticate(self.reader)
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.user)
+
+
+class RecipeTest(RecipeTestCase):
+    def test_recipe_flags(self):
+        url = '/api/recipes/'
+        response = self.reader_client.get(url)
+        self.assertEqual(200, response.status_code)
+        flags = {
+            x['id']: (x['is_favorited'], x['is_in_shopping_cart'])
+            for x in response.data['results']
+        }
+        expected = {
+            self.recipes[0].id: (True, False),
+            self.recipes[1].id: (False, True),
+            self.recipes[2].id: (False, False),
+        }
+        self.assertEqual(
+            expected,
+            flags,
+            msg=(f'При GET запросе {url} поля is_favorited и '
+                 'is_in_shopping_cart некорректные')
+        )
+        # для анонима флаги всегда False
+        response = self.client.get(url)
+        for item in response.data['results']:
+            with self.subTest(recipe=item['id']):
+                self.assertFalse(item['is_favorited'])
+                self.assertFalse(item['is_in_shopping_cart'])
+
+    def test_recipe_flags_filter(self):
+        url = '/api/recipes/?is_favorited=1'
+        response = self.reader_client.get(url)
+        self.assertEqual(
+            [self.recipes[0].id],
+            [x['id'] for x in response.data['results']],
+            msg=f'Фильтр {url} возвращает некорректный результат'
+        )
+        url = '/api/recipes/?is_in_shopping_cart=1'
+        response = self.reader_client.get(url)
+        self.assertEqual(
+            [self.recipes[1].id],
+            [x['id'] for x in response.data['results']],
+            msg=f'Фильтр {url} возвращает некорректный результат'
+        )
+
+    def test_recipe_list_num_queries(self):
+        # валидаторы, рецепты с авторами, теги, ингредиенты; count
+        # закэширован первым запросом
+        url = '/api/recipes/?limit=100'
+        self.client.get(url)
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        self.create_recipe('one more recipe')
+        self.client.get(url)
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+    def test_recipe_list_author_is_subscribed(self):
+        # валидаторы, рецепты с авторами, теги, ингредиенты, подписки
+        # читателя; count закэширован первым запросом
+        url = '/api/recipes/?limit=100'
+        Subscription.objects.create(user=self.reader, following=self.user)
+        self.reader_client.get(url)
+        with self.assertNumQueries(5):
+            response = self.reader_client.get(url)
+        for item in response.data['results']:
+            with self.subTest(recipe=item['id']):
+                self.assertTrue(
+                    item['author']['is_subscribed'],
+                    msg=(f'При GET запросе {url} поле author.is_subscribed '
+                         'некорректное')
+                )
+
+    def test_recipe_detail_num_queries(self):
+        # валидаторы, рецепт с автором, теги, ингредиенты
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(
+            [{'id': self.ingredient.id, 'name': self.ingredient.name,
+              'measurement_unit': self.ingredient.measurement_unit,
+              'amount': 5}],
+            response.data['ingredients'],
+            msg=f'При GET запросе {url} поле ingredients некорректное'
+        )
+
+    def test_update_recipe_ingredients_diff(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.id}/'
+        pepper = Ingredient.objects.create(name='перец', measurement_unit='г')
+        unchanged = IngredientsAmount.objects.create(
+            recipe=recipe, ingredient=pepper, amount=1)
+        onion = Ingredient.objects.create(name='лук', measurement_unit='шт')
+        response = self.author_client.patch(url, {
+            'ingredients': [
+                {'id': self.ingredient.id, 'amount': 7},
+                {'id': pepper.id, 'amount': 1},
+                {'id': onion.id, 'amount': 2},
+            ],
+            'tags': [self.tag.id],
+        }, format='json')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            {self.ingredient.id: 7, pepper.id: 1, onion.id: 2},
+            dict(recipe.ingredient_amounts.values_list('ingredient_id',
+                                                       'amount')),
+            msg=f'При PATCH запросе {url} ингредиенты обновляются некорректно'
+        )
+        # неизмененная строка не перезаписывается
+        self.assertEqual(
+            unchanged.updated_at,
+            IngredientsAmount.objects.get(pk=unchanged.pk).updated_at,
+        )
+
+    def test_create_recipe_validation_num_queries(self):
+        url = '/api/recipes/'
+        ingredients = [
+            Ingredient.objects.create(name=f'ingredient {x}',
+                                      measurement_unit='г')
+            for x in range(10)
+        ]
+        data = {
+            'name': 'recipe',
+            'text': 'text',
+            'cooking_time': 5,
+            'image': 'image',
+            'tags': [self.tag.id, 999],
+            'ingredients': [
+                {'id': x.id, 'amount': 1} for x in ingredients
+            ] + [{'id': 998, 'amount': 1}, {'id': 999, 'amount': 1}],
+        }
+        # ингредиенты и теги проверяются одним запросом каждый
+        with self.assertNumQueries(2):
+            response = self.author_client.post(url, data, format='json')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(
+            2,
+            len([x for x in response.data['ingredients'] if x]),
+            msg=(f'При POST запросе {url} не все несуществующие id '
+                 'ингредиентов попали в ошибку')
+        )
+        self.assertEqual(1, len(response.data['tags']))
+
+
+class TagTest(RecipeTestCase):
+    def test_recipe_tags_filter(self):
+        lunch = Tag.objects.create(name='Обед', color='#49B64E',
+                                   slug='lunch')
+        self.recipes[0].tags.add(lunch)
+        url = '/api/recipes/?tags=breakfast&tags=lunch&limit=100'
+        self.client.get(url)
+        # валидаторы, рецепты, теги, ингредиенты: slug из TagMap
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(
+            [x.id for x in reversed(self.recipes)],
+            [x['id'] for x in response.data['results']],
+            msg=f'Фильтр {url} возвращает повторяющиеся рецепты'
+        )
+        self.assertEqual(3, response.data['count'])
+        url = '/api/recipes/?tags=lunch'
+        response = self.client.get(url)
+        self.assertEqual(
+            [self.recipes[0].id],
+            [x['id'] for x in response.data['results']],
+            msg=f'Фильтр {url} возвращает некорректный результат'
+        )
+        # пустой tags не фильтрует, неизвестные slug пропускаются
+        for query, expected in (
+                ('tags=', list(reversed(self.recipes))),
+                ('tags=unknown', []),
+                ('tags=unknown&tags=lunch', [self.recipes[0]])):
+            url = f'/api/recipes/?{query}'
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(
+                    [x.id for x in expected],
+                    [x['id'] for x in response.data['results']],
+                    msg=f'Фильтр {url} возвращает некорректный результат'
+                )
+
+
+class IngredientTest(RecipeTestCase):
+    def test_ingredient_autocomplete(self):
+        for name in ('морская соль', 'соль крупная', 'фасоль', 'сода'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        url = '/api/ingredients/autocomplete/?name=Соль'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(
+            ['соль', 'соль крупная', 'фасоль', 'морская соль'],
+            [x['name'] for x in response.data],
+            msg=f'При GET запросе {url} порядок результатов некорректный'
+        )
+        self.assertEqual(
+            {'id', 'name', 'measurement_unit'}, set(response.data[0]))
+        response = self.client.get(url + '&limit=2')
+        self.assertEqual(['соль', 'соль крупная'],
+                         [x['name'] for x in response.data])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='соль морская',
+                                      measurement_unit='г')
+        response = self.client.get(url)
+        self.assertIn(
+            'соль морская',
+            [x['name'] for x in response.data],
+            msg=f'При GET запросе {url} индекс не перестроен'
+        )
+        response = self.client.get('/api/ingredients/autocomplete/')
+        self.assertEqual([], response.data)
+
+    def test_recipe_ingredients_filter(self):
+        pepper, onion = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('перец', 'лук')
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            salted = self.create_recipe('соль')
+            peppered = self.create_recipe('соль и перец')
+            IngredientsAmount.objects.create(recipe=peppered,
+                                             ingredient=pepper, amount=1)
+            full = self.create_recipe('соль, перец и лук')
+            for ingredient in (pepper, onion):
+                IngredientsAmount.objects.create(recipe=full,
+                                                 ingredient=ingredient,
+                                                 amount=1)
+        cases = (
+            (f'ingredients={self.ingredient.id}',
+             [salted, peppered, full]),
+            (f'ingredients={pepper.id},{self.ingredient.id}',
+             [peppered, full]),
+            (f'ingredients={self.ingredient.id}'
+             f'&exclude_ingredients={onion.id}',
+             [salted, peppered]),
+            (f'ingredients={pepper.id}&exclude_ingredients={onion.id},0',
+             [peppered]),
+        )
+        for query, expected in cases:
+            url = f'/api/recipes/?{query}'
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(
+                    [x.id for x in expected],
+                    [x['id'] for x in response.data['results']],
+                    msg=f'При GET запросе {url} результаты некорректные'
+                )
+        for query in ('ingredients=1.5', f'ingredients={self.ingredient.id},a',
+                      f'exclude_ingredients={2 ** 63}'):
+            url = f'/api/recipes/?{query}'
+            with self.subTest(url=url):
+                self.assertEqual(400, self.client.get(url).status_code)
+        url = f'/api/recipes/?ingredients={self.ingredient.id}'
+        ids = []
+        response = self.client.get(f'{url}&cursor=&limit=1')
+        while True:
+            ids += [x['id'] for x in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(
+            [x.id for x in (salted, peppered, full)], ids,
+            msg=f'При GET запросе {url} курсор должен сохранять сортировку '
+                'по доле ингредиентов'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            pepper_id = pepper.id
+            pepper.delete()
+        response = self.client.get(
+            f'/api/recipes/?ingredients={self.ingredient.id}'
+            f'&exclude_ingredients={pepper_id}')
+        self.assertEqual(
+            [peppered.id, salted.id, full.id],
+            [x['id'] for x in response.data['results']],
+            msg='Удаление ингредиента должно обновлять множества рецептов'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            full.delete()
+        response = self.client.get(f'/api/recipes/?ingredients={onion.id}')
+        self.assertEqual([], response.data['results'])
+
+    def test_ingredient_relations(self):
+        flour, sugar, butter, margarine = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'сахар', 'масло', 'маргарин')
+        ]
+        for fat in (butter, butter, margarine, margarine):
+            recipe = self.create_recipe('тесто')
+            for ingredient in (flour, sugar, fat):
+                IngredientsAmount.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=1)
+        out = io.StringIO()
+        call_command('build_ingredient_relations', stdout=out)
+        self.assertIn('Сохранено связей ингредиентов: 12', out.getvalue())
+
+        url = '/api/ingredients/suggest/'
+        cases = (
+            (f'ingredients={butter.id}', [flour.id, sugar.id]),
+            (f'ingredients={flour.id},{butter.id}', [sugar.id, margarine.id]),
+            (f'ingredients={self.ingredient.id}', []),
+        )
+        for query, expected in cases:
+            with self.subTest(query=query):
+                with self.assertNumQueries(1):
+                    response = self.client.get(f'{url}?{query}')
+                self.assertEqual(expected, [x['id'] for x in response.data])
+        self.assertEqual(400, self.client.get(
+            f'{url}?ingredients=x').status_code)
+        response = self.client.get(
+            f'/api/ingredients/{butter.id}/substitutes/')
+        self.assertEqual([margarine.id], [x['id'] for x in response.data])
+        self.assertAlmostEqual(1.0, response.data[0]['score'])
+        for pk in (0, 'abc'):
+            self.assertEqual(404, self.client.get(
+                f'/api/ingredients/{pk}/substitutes/').status_code)
+
+
+class ShoppingCartTest(RecipeTestCase):
+    def test_download_shopping_cart(self):
+        url = '/api/recipes/download_shopping_cart/'
+        ShoppingCart.objects.create(author=self.reader, recipe=self.recipes[2])
+        response = self.reader_client.get(url)
+        self.assertEqual(200, response.status_code)
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn(
+            '1. Соль (г) — 10\n',
+            content,
+            msg=f'При GET запросе {url} количество ингредиентов не суммируется'
+        )
+
+    def test_download_shopping_cart_formats(self):
+        url = '/api/recipes/download_shopping_cart/'
+        response = self.reader_client.get(f'{url}?file_format=csv')
+        self.assertEqual(
+            '№,Ингредиент,Единица измерения,Количество\r\n1,соль,г,5\r\n',
+            b''.join(response.streaming_content).decode(),
+            msg=f'При GET запросе {url} csv файл некорректный'
+        )
+        response = self.reader_client.get(f'{url}?file_format=xlsx')
+        sheet = load_workbook(
+            io.BytesIO(b''.join(response.streaming_content))).active
+        self.assertEqual(
+            [(1, 'соль', 'г', 5)],
+            list(sheet.iter_rows(min_row=2, values_only=True)),
+            msg=f'При GET запросе {url} xlsx файл некорректный'
+        )
+        response = self.reader_client.get(f'{url}?file_format=doc')
+        self.assertEqual(400, response.status_code)
+
+    def test_download_shopping_cart_etag(self):
+        url = '/api/recipes/download_shopping_cart/'
+        response = self.reader_client.get(url)
+        etag = response['ETag']
+        # версия листа покупок, данные берутся из кэша
+        with self.assertNumQueries(1):
+            response = self.reader_client.get(url)
+        self.assertEqual(etag, response['ETag'])
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(
+            304,
+            response.status_code,
+            msg=f'При GET запросе {url} с актуальным ETag возвращается 304'
+        )
+        # изменение рецепта из листа покупок меняет версию
+        self.recipes[1].save()
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        # переименование ингредиента не меняет строки листа, но меняет
+        # содержимое файла
+        etag = response['ETag']
+        ingredient = Ingredient.objects.get(pk=self.ingredient.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.name = 'морская соль'
+            ingredient.save()
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertIn('Морская соль',
+                      b''.join(response.streaming_content).decode())
+
+
+class PaginationTest(RecipeTestCase):
+    def test_recipe_list_cursor_pagination(self):
+        url = '/api/recipes/?cursor=&limit=2'
+        # валидаторы, рецепты, теги, ингредиенты: без COUNT(*)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertNotIn('count', response.data)
+        ids = [x['id'] for x in response.data['results']]
+        self.assertIsNone(response.data['previous'])
+        # новый рецепт не сдвигает следующую страницу
+        self.create_recipe('new recipe')
+        response = self.client.get(response.data['next'])
+        ids += [x['id'] for x in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(
+            [x.id for x in reversed(self.recipes)],
+            ids,
+            msg=f'При GET запросе {url} страницы курсора некорректные'
+        )
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(
+            [x.id for x in reversed(self.recipes)][:2],
+            [x['id'] for x in response.data['results']],
+            msg=f'При GET запросе {url} предыдущая страница некорректная'
+        )
+        for position in (['garbage', 1], [None, 1], [{'a': 1}, 1], [1]):
+            for ordering in ('', '&ordering=trending'):
+                cursor = base64.urlsafe_b64encode(
+                    json.dumps({'p': position, 'r': 0}).encode()).decode()
+                url = f'/api/recipes/?cursor={cursor}{ordering}'
+                with self.subTest(url=url):
+                    self.assertEqual(404, self.client.get(url).status_code)
+        response = self.client.get('/api/recipes/?cursor=broken')
+        self.assertEqual(404, response.status_code)
+
+    def test_recipe_list_cached_count(self):
+        url = '/api/recipes/?is_favorited=1'
+        response = self.reader_client.get(url)
+        self.assertEqual(1, response.data['count'])
+        # валидаторы, рецепты, теги, ингредиенты, подписки: COUNT(*)
+        # берется из кэша
+        with self.assertNumQueries(5):
+            response = self.reader_client.get(url)
+        self.assertEqual(1, response.data['count'])
+        FavoriteList.objects.create(author=self.reader, recipe=self.recipes[2])
+        response = self.reader_client.get(url)
+        self.assertEqual(
+            2,
+            response.data['count'],
+            msg=(f'При GET запросе {url} count не обновился после '
+                 'добавления в избранное')
+        )
+        # версия, вытесненная из кэша, не возвращает COUNT прежних версий
+        cache.delete(COUNT_VERSION_KEY.format(
+            FavoriteList._meta.label_lower))
+        response = self.reader_client.get(url)
+        self.assertEqual(2, response.data['count'])
+
+
+class ConditionalGetTest(RecipeTestCase):
+    def test_recipe_list_conditional_get(self):
+        url = '/api/recipes/'
+        response = self.reader_client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        # только валидаторы
+        with self.assertNumQueries(1):
+            response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        response = self.author_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(
+            200,
+            response.status_code,
+            msg=f'При GET запросе {url} ETag не зависит от пользователя'
+        )
+        FavoriteList.objects.filter(author=self.reader).delete()
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(
+            200,
+            response.status_code,
+            msg=(f'При GET запросе {url} ETag не изменился после удаления '
+                 'из избранного')
+        )
+
+    def test_recipe_detail_conditional_get(self):
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.recipes[0].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(
+            200,
+            response.status_code,
+            msg=f'При GET запросе {url} ETag не изменился после сохранения'
+        )
+        response = self.client.get('/api/recipes/0/')
+        self.assertEqual(404, response.status_code)
+        self.assertNotIn('ETag', response)
+        for url in ('/api/recipes/abc/', '/api/tags/abc/',
+                    '/api/ingredients/abc/'):
+            with self.subTest(url=url):
+                self.assertEqual(404, self.client.get(url).status_code)
+
+    def test_catalog_conditional_get(self):
+        for url in ('/api/tags/', '/api/ingredients/'):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(304, response.status_code)
+        etag = self.client.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.save()
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+
+    def test_catalog_cache(self):
+        for url in ('/api/tags/', '/api/ingredients/',
+                    f'/api/tags/{self.tag.id}/'):
+            with self.subTest(url=url):
+                content = self.client.get(url).content
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(content, response.content)
+                with self.assertNumQueries(0):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(304, response.status_code)
+        url = '/api/tags/'
+        content = self.client.get(url).content
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+            self.assertEqual(
+                content, self.client.get(url).content,
+                msg='Версия справочника меняется только после коммита')
+        response = self.client.get(url)
+        self.assertEqual(
+            ['breakfast', 'lunch'],
+            sorted(x['slug'] for x in response.json()),
+            msg=f'При GET запросе {url} кэш не сброшен после записи тега'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.get(slug='lunch').delete()
+        self.assertEqual(1, len(self.client.get(url).json()))
+        response = self.client.get('/api/ingredients/?name=со')
+        self.assertEqual(1, len(response.data))
+
+
+class SearchTest(RecipeTestCase):
+    def test_recipe_search(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            borsch = self.create_recipe('Борщ')
+            soup = self.create_recipe('Суп')
+            soup.text = 'Почти борщ'
+            soup.save()
+            herb = Ingredient.objects.create(name='Кинза',
+                                             measurement_unit='г')
+            salad = self.create_recipe('Салат')
+            IngredientsAmount.objects.create(recipe=salad, ingredient=herb,
+                                             amount=1)
+        for query, expected in (('борщ', [borsch, soup]),
+                                ('суп борщ', [soup]),
+                                ('кинза', [salad]),
+                                ('!!!', [])):
+            url = f'/api/recipes/?search={query}'
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(
+                    [x.id for x in expected],
+                    [x['id'] for x in response.data['results']],
+                    msg=f'При GET запросе {url} результаты некорректные'
+                )
+        with self.captureOnCommitCallbacks(execute=True):
+            herb.name = 'Петрушка'
+            herb.save()
+            borsch.delete()
+        response = self.client.get('/api/recipes/?search=петрушка')
+        self.assertEqual([salad.id],
+                         [x['id'] for x in response.data['results']])
+        response = self.client.get('/api/recipes/?search=борщ')
+        self.assertEqual([soup.id],
+                         [x['id'] for x in response.data['results']])
+
+        # ингредиенты меняются без сохранения рецепта
+        onion = Ingredient.objects.create(name='Лук', measurement_unit='г')
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientsAmount.objects.create(recipe=soup, ingredient=onion,
+                                             amount=1)
+            response = self.author_client.patch(
+                f'/api/recipes/{salad.id}/',
+                {'ingredients': [{'id': onion.id, 'amount': 2}],
+                 'tags': [self.tag.id]},
+                format='json')
+            self.assertEqual(200, response.status_code)
+        for query, expected in (('лук', [salad, soup]), ('петрушка', [])):
+            response = self.client.get(f'/api/recipes/?search={query}')
+            self.assertEqual([x.id for x in expected],
+                             [x['id'] for x in response.data['results']])
+        with self.captureOnCommitCallbacks(execute=True):
+            onion.delete()
+        response = self.client.get('/api/recipes/?search=лук')
+        self.assertEqual([], response.data['results'],
+                         msg='Удаление ингредиента должно обновлять поиск')
+
+    def test_recipe_search_cursor(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for name in ('Борщ', 'Суп', 'Борщ', 'Борщ с чесноком'):
+                recipe = self.create_recipe(name)
+                if name == 'Суп':
+                    recipe.text = 'Почти борщ'
+                    recipe.save()
+        url = '/api/recipes/'
+        response = self.client.get(url, {'search': 'борщ'})
+        expected = [x['id'] for x in response.data['results']]
+        self.assertEqual(4, len(expected))
+        ids = []
+        response = self.client.get(
+            url, {'search': 'борщ', 'cursor': '', 'limit': 1})
+        while True:
+            ids += [x['id'] for x in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(
+            expected, ids,
+            msg=f'При GET запросе {url}?search= курсор должен сохранять '
+                'сортировку по релевантности'
+        )
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(expected[2:3],
+                         [x['id'] for x in response.data['results']])
+
+
+class CounterTest(RecipeTestCase):
+    def test_counters(self):
+        recipe = self.recipes[2]
+        url = f'/api/recipes/{recipe.id}/'
+        response = self.client.get(url)
+        self.assertEqual((0, 0), (response.data['favorites_count'],
+                                  response.data['cart_count']))
+        self.assertEqual(3, response.data['author']['recipes_count'])
+        with self.captureOnCommitCallbacks(execute=True):
+            for client in (self.reader_client, self.author_client):
+                client.get(f'/api/recipes/{recipe.id}/favorite/')
+            self.author_client.get(
+                f'/api/recipes/{recipe.id}/shopping_cart/')
+        recipe.refresh_from_db()
+        self.assertEqual((0, 0), (recipe.favorites_count, recipe.cart_count),
+                         msg='Счетчики пишутся в базу только при сбросе')
+        etag = self.reader_client.get(url)['ETag']
+        self.assertEqual(1, CounterBuffer().flush())
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code,
+                         msg='Сброс счетчиков должен менять ETag')
+        self.assertEqual((2, 1), (response.data['favorites_count'],
+                                  response.data['cart_count']))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reader_client.delete(f'/api/recipes/{recipe.id}/favorite/')
+            self.user.favorite_lists.all().delete()
+        CounterBuffer().flush()
+        recipe.refresh_from_db()
+        self.assertEqual((0, 1), (recipe.favorites_count, recipe.cart_count))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            extra = self.create_recipe('extra')
+        FavoriteList.objects.create(author=self.reader, recipe=extra)
+        self.user.refresh_from_db()
+        self.assertEqual(4, self.user.recipes_count)
+        with self.captureOnCommitCallbacks(execute=True):
+            extra.delete()
+        self.user.refresh_from_db()
+        self.assertEqual(3, self.user.recipes_count)
+
+    def test_counter_buffer(self):
+        recipe = self.recipes[0]
+        for _ in range(3):
+            FavoriteList.objects.filter(recipe=recipe).delete()
+            FavoriteList.objects.create(author=self.reader, recipe=recipe)
+        self.assertEqual(
+            {recipe.id},
+            set(PendingCounter.objects.values_list('recipe_id', flat=True)),
+            msg='Переключения записываются в журнал без строки рецепта'
+        )
+
+        test = self
+
+        class RacingBuffer(CounterBuffer):
+            def recount(self, recipe_ids):
+                super().recount(recipe_ids)
+                # запись, закоммиченная после пересчета пачки
+                if not ShoppingCart.objects.filter(author=test.user,
+                                                   recipe=recipe).exists():
+                    ShoppingCart.objects.create(author=test.user,
+                                                recipe=recipe)
+
+        self.assertEqual(1, RacingBuffer().flush())
+        recipe.refresh_from_db()
+        self.assertEqual((1, 0), (recipe.favorites_count, recipe.cart_count))
+        self.assertEqual(
+            [recipe.id],
+            list(PendingCounter.objects.values_list('recipe_id', flat=True)),
+            msg='Запись, добавленная во время сброса, остается в журнале'
+        )
+        out = io.StringIO()
+        call_command('flush_counters', stdout=out)
+        self.assertEqual('Пересчитано рецептов: 1\n', out.getvalue())
+        recipe.refresh_from_db()
+        self.assertEqual((1, 1), (recipe.favorites_count, recipe.cart_count))
+        self.assertFalse(PendingCounter.objects.exists())
+
+        # журнал удаленного рецепта просто очищается
+        removed = self.create_recipe('Удаленный')
+        FavoriteList.objects.create(author=self.user, recipe=removed)
+        removed.delete()
+        self.assertEqual(1, CounterBuffer().flush())
+        self.assertFalse(PendingCounter.objects.exists())
+
+    def test_recompute_counters(self):
+        Recipe.objects.update(favorites_count=7, cart_count=0)
+        get_user_model().objects.update(recipes_count=0)
+        out = io.StringIO()
+        call_command('recompute_counters', stdout=out)
+        self.assertIn('recipes.Recipe.favorites_count: исправлено 3',
+                      out.getvalue())
+        self.assertEqual(
+            {x.id: (int(x.id == self.recipes[0].id),
+                    int(x.id == self.recipes[1].id))
+             for x in self.recipes},
+            {x.id: (x.favorites_count, x.cart_count)
+             for x in Recipe.objects.all()},
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(3, self.user.recipes_count)
+        out = io.StringIO()
+        call_command('recompute_counters', stdout=out)
+        self.assertNotRegex(out.getvalue(), r'исправлено [1-9]')
+
+
+class StatsTest(RecipeTestCase):
+    def test_view_tracking(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.id}/'
+        self.client.get('/api/recipes/')
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.assertFalse(
+            [x for x in queries
+             if re.match(r'\W*(INSERT|UPDATE|DELETE)', x['sql'])],
+            msg='Просмотр не должен писать в базу')
+        with CaptureQueriesContext(connection) as queries:
+            ViewTracker.record([recipe.id] * ViewTracker.flush_size,
+                               'impressions')
+        self.assertEqual(0, len(queries),
+                         msg='Буфер сбрасывает фоновый поток, а не запрос')
+        self.assertTrue(ViewTracker.flush_requested.is_set())
+        self.assertEqual(3, ViewTracker.flush())
+        ViewTracker.record([recipe.id], 'views')
+        with self.captureOnCommitCallbacks(execute=True):
+            removed = self.create_recipe('removed')
+        removed_id = removed.id
+        ViewTracker.record([removed_id], 'views')
+        with self.captureOnCommitCallbacks(execute=True):
+            removed.delete()
+        self.assertEqual(2, ViewTracker.flush())
+        self.assertEqual(0, ViewTracker.flush())
+
+        response = self.author_client.get(f'{url}stats/')
+        self.assertEqual((3, 1 + ViewTracker.flush_size),
+                         (response.data['views'],
+                          response.data['impressions']))
+        self.assertEqual(1, len(response.data['hours']))
+        expected = (
+            [(recipe.id, 3, 1 + ViewTracker.flush_size)]
+            + [(x.id, 0, 1) for x in self.recipes[:0:-1]]
+        )
+        response = self.author_client.get('/api/recipes/stats/')
+        self.assertEqual(
+            expected,
+            [(x['id'], x['views'], x['impressions']) for x in response.data])
+        response = self.author_client.get('/api/recipes/stats/?limit=1')
+        self.assertEqual(expected[:1], [
+            (x['id'], x['views'], x['impressions']) for x in response.data])
+
+        # статистика доступна только автору и администратору
+        admin = get_user_model().objects.create(
+            email='admin@test.com', username='admin', password='12admin',
+            is_staff=True)
+        admin_client = APIClient()
+        admin_client.force_authenticate(admin)
+        author_url = f'/api/recipes/stats/?author={self.user.id}'
+        self.assertEqual(len(expected),
+                         len(admin_client.get(author_url).data))
+        for client, status in ((self.client, 401), (self.reader_client, 403),
+                               (admin_client, 200)):
+            for stats_url in (f'{url}stats/', author_url):
+                with self.subTest(url=stats_url, status=status):
+                    self.assertEqual(
+                        status, client.get(stats_url).status_code)
+        self.assertEqual(400, admin_client.get(
+            '/api/recipes/stats/?author=abc').status_code)
+        self.assertEqual(404, admin_client.get(
+            f'/api/recipes/stats/?author={admin.id + 1}').status_code)
+        for pk in (removed_id, 'abc'):
+            self.assertEqual(404, self.author_client.get(
+                f'/api/recipes/{pk}/stats/').status_code)
+
+
+class RecommendationTest(RecipeTestCase):
+    def test_trending(self):
+        first, second, third = self.recipes
+        now = timezone.now()
+        FavoriteList.objects.update(updated_at=now - timedelta(days=2))
+        ShoppingCart.objects.update(updated_at=now - timedelta(hours=1))
+        url = '/api/recipes/?ordering=trending'
+        self.assertEqual(2, TrendingScore().refresh())
+        self.assertEqual(0, TrendingScore().refresh(),
+                         msg='Повторное обновление не обрабатывает '
+                             'старые записи')
+        response = self.client.get(url)
+        self.assertEqual([second.id, first.id, third.id],
+                         [x['id'] for x in response.data['results']])
+
+        # прошлое обновление было полчаса назад
+        Watermark.objects.filter(name='trending').update(
+            value=now - timedelta(minutes=30))
+        FavoriteList.objects.create(author=self.user, recipe=third)
+        FavoriteList.objects.filter(recipe=third).update(
+            updated_at=now - timedelta(minutes=10))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(1, TrendingScore().refresh())
+        self.assertEqual(1, len([x for x in queries
+                                 if 'UPDATE "recipes_recipe"' in x['sql']]))
+        # сдвиг epoch сохраняет порядок рецептов
+        Watermark.objects.filter(name='trending_epoch').update(
+            value=now - timedelta(days=60))
+        TrendingScore().refresh()
+        self.assertLess(now - timedelta(minutes=5), Watermark.objects.get(
+            name='trending_epoch').value)
+        expected = [third.id, second.id, first.id]
+        response = self.client.get(url)
+        self.assertEqual(expected,
+                         [x['id'] for x in response.data['results']])
+        response = self.client.get(f'{url}&cursor=&limit=2')
+        self.assertEqual(expected[:2],
+                         [x['id'] for x in response.data['results']])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(expected[2:],
+                         [x['id'] for x in response.data['results']])
+
+    def test_similar_recipes(self):
+        first, second, third = self.recipes
+        users = [
+            get_user_model().objects.create(
+                email=f'fan{x}@test.com', username=f'fan{x}',
+                password=f'12fan{x}')
+            for x in range(2)
+        ]
+        for author, recipe in ((self.reader, second), (users[0], first),
+                               (users[0], second), (users[1], first),
+                               (users[1], third)):
+            FavoriteList.objects.create(author=author, recipe=recipe)
+        out = io.StringIO()
+        call_command('build_similar_recipes', stdout=out)
+        self.assertIn('Сохранено пар похожих рецептов: 4', out.getvalue())
+        response = self.client.get(f'/api/recipes/{first.id}/similar/')
+        self.assertEqual([second.id, third.id],
+                         [x['id'] for x in response.data])
+        for pk in (0, 'abc'):
+            self.assertEqual(404, self.client.get(
+                f'/api/recipes/{pk}/similar/').status_code)
+
+        url = '/api/recipes/recommended/'
+        self.assertEqual(401, self.client.get(url).status_code)
+        response = self.author_client.get(url)
+        self.assertEqual([third.id, second.id, first.id],
+                         [x['id'] for x in response.data],
+                         msg='Без избранного рекомендуются популярные')
+        FavoriteList.objects.create(author=self.user, recipe=third)
+        response = self.author_client.get(url)
+        self.assertEqual([first.id], [x['id'] for x in response.data])
+        self.assertIs(False, response.data[0]['is_favorited'])
+
+
+class QueryPlanTest(TestCase):
+    """Запросы основных эндпоинтов на заполненной базе не должны
+    просматривать растущие таблицы целиком. Справочники тегов и
+    ингредиентов ограничены по размеру и не проверяются.
+    """
+    seeded_tables = (
+        'users_user', 'users_subscription', 'recipes_recipe',
+        'recipes_recipe_tags', 'recipes_ingredientsamount',
+        'recipes_favoritelist', 'recipes_shoppingcart',
+        'recipes_recipe_search', 'recipes_recipe_ingredient_set',
+    )
+    gin_indexes = ('recipes_recipe_search_document',
+                   'recipes_recipe_ingredient_set_ingredient_ids')
+    # на SQLite множества ингредиентов — строки, которые фильтр проверяет
+    # через LIKE, индекс для них не строится
+    sqlite_unindexed = ('recipes_recipe_ingredient_set', )
+    full_scan = {'postgresql': r'Seq Scan on {table}\b',
+                 'sqlite': r'^SCAN (TABLE )?{table}$'}
+    functions = {
+        'postgresql': {
+            'now': 'now()',
+            'minutes_ago': "now() - g * interval '1 minute'",
+        },
+        'sqlite': {
+            'now': "datetime('now')",
+            'minutes_ago': "datetime('now', '-' || g || ' minutes')",
+        },
+    }
+    seed = (
+        "INSERT INTO users_user (password, is_superuser, username, "
+        "first_name, last_name, email, is_staff, is_active, date_joined, "
+        "recipes_count, followers_count) "
+        "SELECT '', false, 'user' || g, 'user', 'user', "
+        "'user' || g || '@test.com', false, true, {now}, 0, 0 "
+        "FROM ({series:10000}) s",
+        "INSERT INTO recipes_tag (name, color, slug, updated_at) "
+        "SELECT 'tag' || g, '#00000' || g, 'tag' || g, {now} "
+        "FROM ({series:3}) s",
+        "INSERT INTO recipes_ingredient (name, measurement_unit, updated_at) "
+        "SELECT 'ingredient ' || g, 'г', {now} "
+        "FROM ({series:2000}) s",
+        "INSERT INTO recipes_recipe (name, text, cooking_time, image, "
+        "author_id, updated_at, favorites_count, cart_count, "
+        "trending_score) "
+        "SELECT 'рецепт ' || g, 'text', 10, 'recipes/images/test.png', "
+        "(SELECT min(id) FROM users_user) + g % 1000, "
+        "{minutes_ago}, 0, 0, g % 97 "
+        "FROM ({series:20000}) s",
+        "INSERT INTO recipes_recipe_tags (recipe_id, tag_id) "
+        "SELECT r.id, t.id FROM recipes_recipe r "
+        "JOIN recipes_tag t ON (r.id + t.id) % 3 = 0",
+        "INSERT INTO recipes_ingredientsamount "
+        "(recipe_id, ingredient_id, amount, updated_at) "
+        "SELECT r.id, i.id, 1, {now} FROM recipes_recipe r "
+        "JOIN recipes_ingredient i ON i.id IN ("
+        "(SELECT min(id) FROM recipes_ingredient) + r.id % 2000, "
+        "(SELECT min(id) FROM recipes_ingredient) + (r.id + 1) % 2000, "
+        "(SELECT min(id) FROM recipes_ingredient) + (r.id + 2) % 2000)",
+        "INSERT INTO recipes_favoritelist (author_id, recipe_id, updated_at) "
+        "SELECT u.id, r.id, {now} FROM users_user u "
+        "JOIN recipes_recipe r ON r.id % 1000 = u.id % 1000 "
+        "WHERE u.id < (SELECT min(id) FROM users_user) + 1000",
+        "INSERT INTO recipes_shoppingcart (author_id, recipe_id, updated_at) "
+        "SELECT u.id, r.id, {now} FROM users_user u "
+        "JOIN recipes_recipe r ON (r.id + 1) % 1000 = u.id % 1000 "
+        "WHERE u.id < (SELECT min(id) FROM users_user) + 1000",
+        "INSERT INTO users_subscription (user_id, following_id, updated_at) "
+        "SELECT u.id, f.id, {now} FROM users_user u "
+        "JOIN users_user f ON f.id % 200 = u.id % 200 AND f.id <> u.id "
+        "WHERE u.id < (SELECT min(id) FROM users_user) + 1000 "
+        "AND f.id < (SELECT min(id) FROM users_user) + 1000",
+    )
+
+    @classmethod
+    def seed_sql(cls, sql):
+        """Подставляет в sql функции дат базы и ряд {series:n} из чисел g
+        от 1 до n: рекурсивный CTE работает и в PostgreSQL, и в SQLite.
+        """
+        sql = re.sub(
+            r'\{series:(\d+)\}',
+            r'WITH RECURSIVE s (g) AS (SELECT 1 UNION ALL '
+            r'SELECT g + 1 FROM s WHERE g < \1) SELECT g FROM s',
+            sql)
+        for name, function in cls.functions[connection.vendor].items():
+            sql = sql.replace(f'{{{name}}}', function)
+        return sql
+
+    @classmethod
+    def setUpTestData(cls):
+        with connection.cursor() as cursor:
+            for sql in cls.seed:
+                cursor.execute(cls.seed_sql(sql))
+        recipe_ids = Recipe.objects.values_list('id', flat=True)
+        RecipeSearch().update(recipe_ids)
+        RecipeIngredientSet().update(recipe_ids)
+        call_command('recompute_counters', stdout=io.StringIO())
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # записи после создания GIN индекса лежат в списке
+                # ожидания, который в рабочей базе переносит в индекс
+                # autovacuum
+                for index in cls.gin_indexes:
+                    cursor.execute(
+                        'SELECT gin_clean_pending_list(%s::regclass)',
+                        [index])
+            cursor.execute('ANALYZE')
+        cls.user = get_user_model().objects.order_by('id').first()
+        cls.recipe = Recipe.objects.filter(author=cls.user).first()
+        cls.ingredient = cls.recipe.ingredients.first()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        # ANALYZE пишет pg_class.reltuples вне транзакции, оценка размера
+        # откатанных таблиц возвращается повторным ANALYZE
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_plan(self, sql):
+        explain = {'postgresql': 'EXPLAIN',
+                   'sqlite': 'EXPLAIN QUERY PLAN'}[connection.vendor]
+        with connection.cursor() as cursor:
+            cursor.execute(f'{explain} {sql}')
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def assert_index_plans(self, url, indexes=()):
+        """Проверяет запросы повторного GET: COUNT(*) к этому моменту
+        закэширован CachedCountPaginator. Ни один запрос не должен
+        просматривать растущую таблицу целиком. На SQLite в планах также
+        должны встречаться индексы indexes: PostgreSQL выбирает индекс по
+        стоимости и на малой выборке может взять индекс внешнего ключа.
+        """
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        tables = self.seeded_tables
+        if connection.vendor == 'sqlite':
+            tables = set(tables) - set(self.sqlite_unindexed)
+        plans = []
+        for query in context.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            plan = self.get_plan(query['sql'])
+            plans.append(plan)
+            for table in tables:
+                self.assertIsNone(
+                    re.search(self.full_scan[connection.vendor].format(
+                        table=table), plan, re.MULTILINE),
+                    msg=(f'При GET запросе {url} запрос просматривает '
+                         f'{table} целиком:\n{query["sql"]}\n{plan}')
+                )
+        if connection.vendor != 'sqlite':
+            return
+        for index in indexes:
+            self.assertRegex(
+                '\n'.join(plans), rf'\b{index}\b',
+                msg=f'При GET запросе {url} не используется индекс {index}'
+            )
+
+    def test_query_plans(self):
+        probe_indexes = ('favorite_author_updated_idx',
+                         'cart_author_updated_idx',
+                         'subscription_user_updated_idx')
+        urls = (
+            ('/api/recipes/',
+             ('recipe_updated_at_id_idx', ) + probe_indexes),
+            ('/api/recipes/?is_favorited=1', ()),
+            ('/api/recipes/?is_in_shopping_cart=1', ()),
+            (f'/api/recipes/?author={self.user.id}',
+             ('recipe_author_updated_idx', )),
+            ('/api/recipes/?tags=tag1', ()),
+            ('/api/recipes/?search=12345', ()),
+            ('/api/recipes/?ordering=trending', ('recipe_trending_idx', )),
+            (f'/api/recipes/?ingredients={self.ingredient.id}', ()),
+            (f'/api/recipes/{self.recipe.id}/', probe_indexes),
+            ('/api/users/subscriptions/?recipes_limit=3',
+             ('subscription_user_updated_idx',
+              'recipe_author_updated_idx')),
+            ('/api/recipes/download_shopping_cart/', ()),
+        )
+        for url, indexes in urls:
+            with self.subTest(url=url):
+                self.assert_index_plans(url, indexes)
@@ -1,48 +1,341 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Prefetch, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.mixins import CreateModelMixin, DestroyModelMixin
+from rest_framework.pagination import _positive_int
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
+from users.models import Subscription
+from utils.mixins import ConditionalGetMixin
 
 from .filters import IngredientFilter, RecipeFilter
-from .models import FavoriteList, Ingredient, Recipe, ShoppingCart, Tag
-from .permissions import ActiveCurrentUserOrAdminOrReadOnly, AdminOrReadOnly
+from .models import (
+    FavoriteList, Ingredient, IngredientRelation, IngredientsAmount, Recipe,
+    RecipeNeighbour, ShoppingCart, Tag,
+)
+from .permissions import (
+    ActiveAuthorOrAdmin, ActiveCurrentUserOrAdminOrReadOnly, AdminOrReadOnly,
+)
 from .serializers import (
     FavoriteListSerializer, IngredientSerializers, RecipeSerializers,
     ShoppingCartSerializer, TagSerializers,
 )
-from .services import DownloadList
+from .services import (
+    RENDERERS, CatalogCache, DownloadList, IngredientIndex, ShoppingListCache,
+    ViewTracker,
+)
+
+
+class CatalogCacheMixin:
+    """ list и retrieve справочника из CatalogCache.
+
+    Кэшируются JSON ответы без параметров запроса, ETag ответа строится по
+    версии справочника. Остальные запросы обрабатываются как обычно.
+    """
+    catalog_media_type = 'application/json'
+
+    def list(self, request, *args, **kwargs):
+        return self._catalog_response(
+            'list', super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return self._catalog_response(
+            f'detail:{self.kwargs[lookup_url_kwarg]}', super().retrieve,
+            request, *args, **kwargs)
 
+    def _catalog_response(self, name, handler, request, *args, **kwargs):
+        if (request.query_params
+                or request.accepted_media_type != self.catalog_media_type):
+            return handler(request, *args, **kwargs)
+        catalog = CatalogCache(self.get_queryset().model)
+        etag = f'"{catalog.version}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            content = catalog.get(name)
+            if content is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                content = request.accepted_renderer.render(
+                    response.data, request.accepted_media_type,
+                    self.get_renderer_context())
+                catalog.set(name, content)
+            response = HttpResponse(content,
+                                    content_type=self.catalog_media_type)
+        response['ETag'] = etag
+        return response
 
-class TagView(ModelViewSet):
+
+class TagView(CatalogCacheMixin, ConditionalGetMixin, ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializers
     pagination_class = None
     permission_classes = (AdminOrReadOnly, )
 
 
-class IngredientView(ModelViewSet):
+class IngredientView(CatalogCacheMixin, ConditionalGetMixin,
+                     ModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializers
     pagination_class = None
     permission_classes = (AdminOrReadOnly, )
     filter_backends = (IngredientFilter, )
     search_fields = ('^name', )
+    suggestion_limit = 10
+    suggestion_max_limit = 50
+
+    @action(['GET'], detail=False)
+    def autocomplete(self, request):
+        """Автодополнение по параметру name из IngredientIndex без
+        запросов к базе, не больше limit результатов.
+        """
+        return Response(IngredientIndex.get().search(
+            request.query_params.get('name', ''), self.get_limit(request)))
+
+    @action(['GET'], detail=False)
+    def suggest(self, request):
+        """Ингредиенты, которые чаще сочетаются с ингредиентами из
+        параметра ingredients (id через запятую), по сумме PMI из
+        IngredientRelation, которую строит build_ingredient_relations.
+        """
+        try:
+            ids = [int(x) for x in
+                   request.query_params['ingredients'].split(',')]
+        except (KeyError, ValueError):
+            raise ValidationError(
+                {'ingredients': 'Укажите id ингредиентов через запятую.'})
+        return Response(Ingredient.objects.filter(
+            related_to__ingredient_id__in=ids,
+            related_to__kind=IngredientRelation.PAIR,
+        ).exclude(id__in=ids).annotate(
+            score=Sum('related_to__score')
+        ).order_by('-score', 'id').values(
+            'id', 'name', 'measurement_unit', 'score'
+        )[:self.get_limit(request)])
+
+    @action(['GET'], detail=True)
+    def substitutes(self, request, pk=None):
+        """Ингредиенты с похожими сочетаниями, которые редко встречаются
+        вместе с этим.
+        """
+        ingredient = get_object_or_404(Ingredient.objects.only('id'), pk=pk)
+        return Response(Ingredient.objects.filter(
+            related_to__ingredient=ingredient,
+            related_to__kind=IngredientRelation.SUBSTITUTE,
+        ).annotate(
+            score=F('related_to__score')
+        ).order_by('-score', 'id').values(
+            'id', 'name', 'measurement_unit', 'score'
+        )[:self.get_limit(request)])
 
+    def get_limit(self, request) -> int:
+        try:
+            return _positive_int(request.query_params['limit'],
+                                 strict=True,
+                                 cutoff=self.suggestion_max_limit)
+        except (KeyError, ValueError):
+            return self.suggestion_limit
 
-class RecipeView(ModelViewSet):
-    queryset = Recipe.objects.get_queryset()
+
+class RecipeView(ConditionalGetMixin, ModelViewSet):
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch(
+            'ingredient_amounts',
+            queryset=IngredientsAmount.objects.select_related('ingredient')
+        ),
+    )
     serializer_class = RecipeSerializers
     permission_classes = (ActiveCurrentUserOrAdminOrReadOnly, )
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
+    count_cache_models = (Recipe, FavoriteList, ShoppingCart)
+    etag_models = (Subscription, )
+    stats_hours = 24
+    stats_max_hours = 30 * 24
+    stats_limit = 20
+    stats_max_limit = 100
+    recommended_limit = 20
+    recommended_max_limit = 50
+
+    cursor_ordering = ('-updated_at', '-id')
+
+    def paginate_queryset(self, queryset):
+        """Курсор строится по сортировке, которую задали фильтры: по рангу
+        поиска, доле ингредиентов или популярности, иначе по
+        cursor_ordering.
+        """
+        if queryset.query.order_by:
+            self.cursor_ordering = tuple(queryset.query.order_by)
+        return super().paginate_queryset(queryset)
+
+    def get_queryset(self):
+        """Флаги is_favorited и is_in_shopping_cart вычисляются в том же
+        запросе, что и список рецептов, а не отдельным запросом на рецепт.
+        """
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(FavoriteList.objects.filter(
+                author=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                author=user, recipe=OuterRef('pk'))),
+        )
+
+    def get_related_probes(self) -> list:
+        """Данные вне таблицы рецептов, от которых зависит ответ: флаги
+        пользователя и справочники тегов и ингредиентов.
+        """
+        probes = [Tag.objects.all(), Ingredient.objects.all()]
+        user = self.request.user
+        if user.is_authenticated:
+            probes += [user.favorite_lists.all(), user.shopping_lists.all(),
+                       user.follower.all()]
+        return probes
+
+    def get_list_probes(self):
+        return super().get_list_probes() + self.get_related_probes()
+
+    def get_object_probes(self):
+        return super().get_object_probes() + self.get_related_probes()
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    def perform_destroy(self, instance):
-        instance.ingredients.all().delete()
-        super().perform_destroy(instance)
+    def list(self, request, *args, **kwargs):
+        """Рецепты страницы учитываются как показы."""
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            ViewTracker.record(
+                [x['id'] for x in response.data['results']], 'impressions')
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        """Просмотром считается и ответ 304 по ETag."""
+        response = super().retrieve(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            ViewTracker.record([int(kwargs['pk'])], 'views')
+        return response
+
+    @action(['GET'], detail=True, permission_classes=(ActiveAuthorOrAdmin, ))
+    def stats(self, request, pk=None):
+        """Просмотры и показы рецепта по часам за последние hours часов.
+        События из буферов процессов появляются после их сброса.
+        """
+        recipe = get_object_or_404(
+            Recipe.objects.select_related('author'), pk=pk)
+        self.check_object_permissions(request, recipe.author)
+        hours = list(recipe.view_stats.filter(
+            hour__gte=self.get_stats_since(request)
+        ).order_by('hour').values('hour', 'views', 'impressions'))
+        return Response({
+            'views': sum(x['views'] for x in hours),
+            'impressions': sum(x['impressions'] for x in hours),
+            'hours': hours,
+        })
+
+    @action(['GET'], detail=False, url_path='stats',
+            permission_classes=(ActiveAuthorOrAdmin, ))
+    def author_stats(self, request):
+        """Просмотры и показы рецептов автора за последние hours часов, не
+        больше limit рецептов по убыванию просмотров. Автор — текущий
+        пользователь, администратор может указать другого параметром
+        author.
+        """
+        author = request.user
+        if 'author' in request.query_params:
+            try:
+                author_id = _positive_int(request.query_params['author'],
+                                          strict=True)
+            except ValueError:
+                raise ValidationError({'author': 'Укажите id автора.'})
+            author = get_object_or_404(get_user_model(), pk=author_id)
+        self.check_object_permissions(request, author)
+        try:
+            limit = _positive_int(request.query_params['limit'],
+                                  strict=True,
+                                  cutoff=self.stats_max_limit)
+        except (KeyError, ValueError):
+            limit = self.stats_limit
+        since = Q(view_stats__hour__gte=self.get_stats_since(request))
+        return Response(Recipe.objects.filter(author=author).annotate(
+            views=Coalesce(Sum('view_stats__views', filter=since), 0),
+            impressions=Coalesce(
+                Sum('view_stats__impressions', filter=since), 0),
+        ).order_by('-views', '-id').values(
+            'id', 'name', 'views', 'impressions')[:limit])
+
+    @action(['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """Рецепты, которые чаще добавляют в избранное вместе с этим, из
+        таблицы RecipeNeighbour, которую строит build_similar_recipes.
+        """
+        recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+        queryset = self.get_queryset().filter(
+            similar_to__recipe=recipe
+        ).order_by('-similar_to__score', 'id')
+        return Response(self.get_serializer(queryset, many=True).data)
+
+    @action(['GET'], detail=False, permission_classes=(IsAuthenticated, ))
+    def recommended(self, request):
+        """Соседи рецептов из избранного пользователя, которых в избранном
+        еще нет, по сумме сходства. Без избранного или соседей
+        возвращаются популярные рецепты.
+        """
+        try:
+            limit = _positive_int(request.query_params['limit'],
+                                  strict=True,
+                                  cutoff=self.recommended_max_limit)
+        except (KeyError, ValueError):
+            limit = self.recommended_limit
+        scores = dict(RecipeNeighbour.objects.filter(
+            recipe__favorite_lists__author=request.user
+        ).exclude(
+            neighbour__favorite_lists__author=request.user
+        ).values('neighbour_id').annotate(
+            total=Sum('score')
+        ).order_by('-total', 'neighbour_id').values_list(
+            'neighbour_id', 'total'
+        )[:limit])
+        queryset = self.get_queryset()
+        if scores:
+            recipes = sorted(queryset.filter(id__in=scores),
+                             key=lambda x: (-scores[x.id], x.id))
+        else:
+            recipes = queryset.exclude(
+                favorite_lists__author=request.user
+            ).order_by('-trending_score', '-id')[:limit]
+        return Response(self.get_serializer(recipes, many=True).data)
+
+    def get_stats_since(self, request):
+        """Начало часа, с которого берется статистика, текущий час входит
+        в hours.
+        """
+        try:
+            hours = _positive_int(request.query_params['hours'],
+                                  strict=True,
+                                  cutoff=self.stats_max_hours)
+        except (KeyError, ValueError):
+            hours = self.stats_hours
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        return hour - timedelta(hours=hours - 1)
 
 
 class FavoriteView(CreateModelMixin, DestroyModelMixin, GenericViewSet):
@@ -56,6 +349,13 @@ class FavoriteView(CreateModelMixin, DestroyModelMixin, GenericViewSet):
             return queryset.filter(author=self.request.user)
         return queryset
 
+    @transaction.atomic
+    def perform_create(self, serializer):
+        """Запись журнала CounterBuffer из сигнала post_save сохраняется в
+        одной транзакции с записью.
+        """
+        serializer.save()
+
 
 class ShoppingCartView(CreateModelMixin, DestroyModelMixin, GenericViewSet):
     serializer_class = ShoppingCartSerializer
@@ -68,11 +368,31 @@ class ShoppingCartView(CreateModelMixin, DestroyModelMixin, GenericViewSet):
             return queryset.filter(author=self.request.user)
         return queryset
 
+    @transaction.atomic
+    def perform_create(self, serializer):
+        """Запись журнала CounterBuffer из сигнала post_save сохраняется в
+        одной транзакции с записью.
+        """
+        serializer.save()
+
     @action(['GET'], url_name='get_file', detail=False)
     def get_file(self, request, *args, **kwargs):
-        queryset = request.user.shopping_lists.values_list(
-            'recipe__ingredients__ingredient__name',
-            'recipe__ingredients__ingredient__measurement_unit',
-            'recipe__ingredients__amount'
-        )
-        return DownloadList(queryset).download_file()
+        """Формат файла задается параметром file_format (по умолчанию txt),
+        параметр format зарезервирован DRF. ETag строится из версии
+        листа покупок, при совпадении If-None-Match возвращается 304.
+        """
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in RENDERERS:
+            raise ValidationError({
+                'errors': ('Доступные форматы файла: '
+                           f'{", ".join(RENDERERS)}.'),
+            })
+        shopping_list = ShoppingListCache(request.user)
+        etag = f'"{shopping_list.version}-{file_format}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = DownloadList(shopping_list.get_data(),
+                                    file_format).download_file()
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
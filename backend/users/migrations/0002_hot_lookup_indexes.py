@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-18 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user', '-updated_at'], name='subscription_user_updated_idx'),
+        ),
+    ]
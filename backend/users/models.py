@@ -29,6 +29,18 @@ class User(AbstractUser):
         verbose_name=_('Фамилия'),
         help_text=_('Фамилия пользователя.')
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('Количество рецептов'),
+        help_text=_('Обновляется автоматически при изменении рецептов.')
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('Количество подписчиков'),
+        help_text=_('Обновляется автоматически при изменении подписок.')
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name',)
 
@@ -66,6 +78,10 @@ class Subscription(models.Model):
         verbose_name = 'Подписки'
         verbose_name_plural = 'Подписки'
         ordering = ('-updated_at',)
+        indexes = (
+            models.Index(fields=('user', '-updated_at'),
+                         name='subscription_user_updated_idx'),
+        )
         constraints = [
             models.UniqueConstraint(fields=['user', 'following'],
                                     name='unique_subscription')
@@ -1,5 +1,262 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import hashlib
+import json
+import uuid
+
+from collections import OrderedDict
+from functools import reduce
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination, PageNumberPagination, _positive_int,
+)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+COUNT_VERSION_KEY = 'count_version:{}'
+
+
+def get_count_version(model) -> str:
+    """Потерянная кэшем версия заменяется новой, а не пустой строкой:
+    иначе вернулись бы COUNT и ETag, посчитанные при прежней пустой
+    версии.
+    """
+    return cache.get_or_set(COUNT_VERSION_KEY.format(model._meta.label_lower),
+                            uuid.uuid4().hex, None)
+
+
+def bump_count_version(model):
+    """Сбрасывает закэшированные COUNT всех запросов, зависящих от model.
+    """
+    cache.set(COUNT_VERSION_KEY.format(model._meta.label_lower),
+              uuid.uuid4().hex, None)
+
+
+class CachedCountPaginator(Paginator):
+    """ Paginator, который кэширует COUNT(*) по тексту запроса и версиям
+    моделей, от которых он зависит.
+
+    Для запросов без условий на PostgreSQL используется оценка
+    планировщика pg_class.reltuples, если таблица больше
+    estimate_threshold строк.
+    """
+    timeout = 30
+    estimate_threshold = 10000
+
+    def __init__(self, object_list, per_page, models=(), **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.models = models or (object_list.model, )
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        versions = [get_count_version(model) for model in self.models]
+        key = 'count:' + hashlib.md5(
+            f'{sql}:{params}:{versions}'.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = self.get_estimate(queryset)
+            if count is None:
+                count = queryset.count()
+            cache.set(key, count, self.timeout)
+        return count
+
+    def get_estimate(self, queryset):
+        """:return: None | int"""
+        connection = connections[queryset.db]
+        if (connection.vendor != 'postgresql' or queryset.query.where
+                or queryset.query.distinct):
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row is None or row[0] < self.estimate_threshold:
+            return None
+        return int(row[0])
+
+
+class KeysetPagination(BasePagination):
+    """ Пагинация по ключу (updated_at, id) без OFFSET и COUNT(*).
+
+    Курсор хранит значения полей сортировки последней (или первой для
+    предыдущей страницы) записи, следующая страница выбирается условием
+    «строго после курсора», поэтому новые записи не сдвигают страницы.
+    Поля сортировки задаются атрибутом представления cursor_ordering,
+    последним полем должен быть уникальный ключ.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    ordering = ('-updated_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+
+        cursor = self.decode_cursor(request, queryset)
+        reverse = bool(cursor and cursor['reverse'])
+        ordering = self._invert(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if cursor:
+            queryset = queryset.filter(
+                self._after_position(cursor['position'], ordering))
+
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = page
+        return page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def decode_cursor(self, request, queryset):
+        """Значения позиции приводятся к типам полей сортировки queryset,
+        поэтому подделанный курсор дает 404, а не ошибку запроса.
+        :return: None | dict(position(list), reverse(bool))
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position, reverse = data['p'], bool(data['r'])
+            if not isinstance(position, list) or (
+                    len(position) != len(self.ordering)):
+                raise ValueError
+            position = [
+                self._to_python(queryset, field, value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (binascii.Error, ValueError, TypeError, KeyError,
+                ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return {'position': position, 'reverse': reverse}
+
+    @staticmethod
+    def _to_python(queryset, field, value):
+        """Приводит значение к типу поля модели или аннотации queryset."""
+        name = field.lstrip('-')
+        if name in queryset.query.annotations:
+            model_field = queryset.query.annotations[name].output_field
+        else:
+            model_field = queryset.model._meta.get_field(name)
+        value = model_field.to_python(value)
+        if value is None:
+            raise ValueError
+        return value
+
+    def encode_cursor(self, instance, reverse):
+        position = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            position.append(
+                value.isoformat() if hasattr(value, 'isoformat') else value)
+        encoded = base64.urlsafe_b64encode(
+            json.dumps({'p': position, 'r': int(reverse)}).encode()
+        ).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   encoded)
+
+    @staticmethod
+    def _invert(ordering):
+        return tuple(
+            x[1:] if x.startswith('-') else f'-{x}' for x in ordering
+        )
+
+    @staticmethod
+    def _after_position(position, ordering):
+        """Лексикографическое условие (f1, f2, ...) > (v1, v2, ...) с учетом
+        направления сортировки каждого поля.
+        """
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {
+                x.lstrip('-'): value
+                for x, value in zip(ordering[:index], position[:index])
+            }
+            conditions.append(
+                Q(**equal, **{f'{name}__{lookup}': position[index]}))
+        return reduce(lambda x, y: x | y, conditions)
 
 
 class ListLimitPagination(PageNumberPagination):
+    """ Постраничная пагинация с параметром limit.
+
+    Если в запросе передан параметр cursor (для первой страницы пустой),
+    используется KeysetPagination. Количество записей кэшируется
+    CachedCountPaginator, модели, изменение которых меняет количество,
+    задаются атрибутом представления count_cache_models.
+    """
     page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            self.keyset.page_size = self.get_page_size(request)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.count_models = getattr(view, 'count_cache_models', ())
+        return super().paginate_queryset(queryset, request, view)
+
+    def django_paginator_class(self, queryset, page_size):
+        return CachedCountPaginator(queryset, page_size,
+                                    models=self.count_models)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
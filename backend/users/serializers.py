@@ -12,14 +12,29 @@ class UserBaseSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
-                  'password', 'is_subscribed')
+                  'password', 'is_subscribed', 'recipes_count',
+                  'followers_count')
         extra_kwargs = {'password': {'write_only': True}}
 
     def get_is_subscribed(self, instance):
-        user = self.context['request'].user
-        if user.is_anonymous:
+        request = self.context['request']
+        if request.user.is_anonymous:
             return False
-        return instance.following.filter(user=user).exists()
+        return instance.id in self._get_following_ids(request)
+
+    @staticmethod
+    def _get_following_ids(request) -> set:
+        """Id авторов, на которых подписан пользователь запроса.
+        Загружаются одним запросом и хранятся в request, поэтому все
+        вложенные сериализаторы пользователя в одном ответе обращаются
+        к базе не более одного раза.
+        :return: set(id)
+        """
+        if not hasattr(request, 'following_ids'):
+            request.following_ids = set(
+                request.user.follower.values_list('following_id', flat=True)
+            )
+        return request.following_ids
 
 
 class CreateAccountSerializer(UserCreateSerializer):
@@ -0,0 +1,27 @@
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Subscription, User
+from .pagination import bump_count_version
+
+
+@receiver((post_save, post_delete), sender=User)
+@receiver((post_save, post_delete), sender=Subscription)
+def reset_users_count(sender, **kwargs):
+    bump_count_version(sender)
+
+
+@receiver(post_save, sender=Subscription)
+def increment_followers_count(sender, instance, created, raw=False,
+                              **kwargs):
+    if created and not raw:
+        User.objects.filter(pk=instance.following_id).update(
+            followers_count=F('followers_count') + 1)
+
+
+@receiver(post_delete, sender=Subscription)
+def decrement_followers_count(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.following_id).update(
+        followers_count=Greatest(F('followers_count') - 1, 0))
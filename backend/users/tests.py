@@ -1,6 +1,10 @@
+import base64
+import json
+
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.utils.translation import gettext_lazy as _
+from recipes.models import Recipe
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
@@ -509,6 +513,124 @@ class SubscriptionTest(TestCase):
             field_result_count=0,
             field_type_results=list)
 
+    def test_get_subscriptions_recipes_limit(self):
+        url = '/api/users/subscriptions/?recipes_limit=2'
+        Subscription.objects.create(user=self.user1, following=self.user2)
+        for x in range(3):
+            Recipe.objects.create(
+                author=self.user2,
+                name=f'recipe {x}',
+                text='text',
+                cooking_time=10,
+                image='recipes/images/test.png',
+            )
+        # токен, валидаторы, count, авторы с recipes_count, рецепты
+        # авторов, подписки
+        with self.assertNumQueries(6):
+            response = self.follower.get(
+                url,
+                HTTP_AUTHORIZATION=self.follower_token
+            )
+        author = response.data['results'][0]
+        self.assertEqual(
+            3,
+            author['recipes_count'],
+            msg=f'При GET запросе {url} поле recipes_count некорректное'
+        )
+        self.assertEqual(
+            ['recipe 2', 'recipe 1'],
+            [x['name'] for x in author['recipes']],
+            msg=(f'При GET запросе {url} параметр recipes_limit '
+                 'работает некорректно')
+        )
+
+    def test_get_subscriptions_cursor(self):
+        url = '/api/users/subscriptions/?cursor=&limit=1'
+        authors = [
+            get_user_model().objects.create(
+                email=f'author{x}@test.com',
+                username=f'author{x}',
+                first_name='author',
+                last_name='author',
+                password='12author',
+            ) for x in range(3)
+        ]
+        for author in authors:
+            Subscription.objects.create(user=self.user1, following=author)
+        ids = []
+        while url:
+            response = self.follower.get(
+                url,
+                HTTP_AUTHORIZATION=self.follower_token
+            )
+            self.assertEqual(200, response.status_code)
+            ids += [x['id'] for x in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(
+            [x.id for x in reversed(authors)],
+            ids,
+            msg=('При GET запросе /api/users/subscriptions/ с курсором '
+                 'порядок подписок некорректный')
+        )
+        for position in (['x'], ['x', 1], [None, 1]):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps({'p': position, 'r': 0}).encode()).decode()
+            for url in (f'/api/users/?cursor={cursor}',
+                        f'/api/users/subscriptions/?cursor={cursor}'):
+                with self.subTest(url=url):
+                    response = self.follower.get(
+                        url, HTTP_AUTHORIZATION=self.follower_token)
+                    self.assertEqual(404, response.status_code)
+
+    def test_get_subscriptions_conditional_get(self):
+        url = '/api/users/subscriptions/'
+        Subscription.objects.create(user=self.user1, following=self.user2)
+        etag = self.follower.get(
+            url, HTTP_AUTHORIZATION=self.follower_token)['ETag']
+        response = self.follower.get(
+            url,
+            HTTP_AUTHORIZATION=self.follower_token,
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(304, response.status_code)
+        Recipe.objects.create(
+            author=self.user2,
+            name='new recipe',
+            text='text',
+            cooking_time=10,
+            image='recipes/images/test.png',
+        )
+        response = self.follower.get(
+            url,
+            HTTP_AUTHORIZATION=self.follower_token,
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(
+            200,
+            response.status_code,
+            msg=(f'При GET запросе {url} ETag не изменился после нового '
+                 'рецепта автора')
+        )
+
+    def test_followers_count(self):
+        url = f'/api/users/{self.user2.id}/subscribe/'
+        self.follower.get(url, HTTP_AUTHORIZATION=self.follower_token)
+        response = self.follower.get(
+            '/api/users/subscriptions/',
+            HTTP_AUTHORIZATION=self.follower_token
+        )
+        self.assertEqual(1, response.data['results'][0]['followers_count'])
+        self.follower.delete(url, HTTP_AUTHORIZATION=self.follower_token)
+        self.user2.refresh_from_db()
+        self.assertEqual(0, self.user2.followers_count)
+        # подписки удаляются каскадно вместе с подписчиком
+        follower = get_user_model().objects.create(
+            email='removed@test.com', username='removed', password='12removed')
+        Subscription.objects.create(user=follower, following=self.user2)
+        follower.delete()
+        self.user2.refresh_from_db()
+        self.assertEqual(0, self.user2.followers_count)
+
     def test_get_subscribe(self):
         url = '/api/users/2/subscribe/'
         url404 = '/api/users/200/subscribe/'
@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
+from django.db.models import F, OuterRef, Prefetch, Subquery
 from djoser.permissions import CurrentUserOrAdmin
 from djoser.views import UserViewSet
+from recipes.models import Recipe
 from recipes.serializers import SubscribeSerializer, SubscriptionsSerializer
 from rest_framework.decorators import action
 from rest_framework.mixins import (
@@ -8,6 +10,7 @@ from rest_framework.mixins import (
 )
 from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
 from rest_framework.viewsets import GenericViewSet
+from utils.mixins import ConditionalGetMixin
 
 from .models import Subscription
 
@@ -15,6 +18,7 @@ User = get_user_model()
 
 
 class UsersView(UserViewSet):
+    cursor_ordering = ('id', )
 
     def get_queryset(self):
         if self.request.method in SAFE_METHODS:
@@ -29,20 +33,45 @@ class UsersView(UserViewSet):
         return super().me(request, *args, **kwargs)
 
 
-class SubscriptionsListView(ListModelMixin,
+class SubscriptionsListView(ConditionalGetMixin,
+                            ListModelMixin,
                             CreateModelMixin,
                             DestroyModelMixin,
                             GenericViewSet):
     queryset = Subscription.objects.all()
     permission_classes = (IsAuthenticated,)
     lookup_field = 'following_id'
+    cursor_ordering = ('-subscribed_at', '-id')
+    count_cache_models = (Subscription, )
 
     def list(self, request, *args, **kwargs):
+        """Авторы, на которых подписан пользователь, в порядке подписки.
+        recipes_count хранится в модели, а recipes_limit ограничивает
+        рецепты каждого автора в запросе prefetch_related.
+        """
         self.serializer_class = SubscriptionsSerializer
+        recipes = Recipe.objects.all()
+        recipes_limit = SubscriptionsSerializer.get_recipes_limit(request)
+        if recipes_limit is not None:
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('id')[:recipes_limit]
+            ))
         self.queryset = User.objects.filter(
-            following__user__follower__user=request.user).distinct()
+            following__user=request.user
+        ).annotate(
+            subscribed_at=F('following__updated_at'),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes)
+        ).order_by('-subscribed_at', '-id')
         return super().list(request, args, kwargs)
 
+    def get_list_probes(self):
+        user = self.request.user
+        return [user.follower.all(),
+                Recipe.objects.filter(author__following__user=user)]
+
     @action(['GET'], url_name='subscribe', detail=False)
     def create(self, request, *args, **kwargs):
         self.serializer_class = SubscribeSerializer
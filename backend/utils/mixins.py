@@ -0,0 +1,83 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Max, Value
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from users.pagination import get_count_version
+
+
+def probe_querysets(querysets) -> list:
+    """Одним запросом UNION ALL вычисляет Max(updated_at) каждого
+    queryset. Max без других агрегатов PostgreSQL берет из индекса по
+    updated_at, не просматривая таблицу.
+    :return: list(tuple(index, last_modified))
+    """
+    parts = [
+        queryset.order_by().prefetch_related(None).annotate(
+            probe=Value(index)
+        ).values('probe').annotate(
+            last_modified=Max('updated_at'),
+        ).values_list('probe', 'last_modified')
+        for index, queryset in enumerate(querysets)
+    ]
+    return sorted(parts[0].union(*parts[1:], all=True))
+
+
+class ConditionalGetMixin:
+    """ ETag и Last-Modified для list и retrieve.
+
+    Валидаторы строятся по querysets из get_list_probes/get_object_probes
+    без формирования тела ответа. Удаление записи не меняет
+    Max(updated_at), поэтому в ETag входят и версии моделей из
+    get_count_version, которые сигналы меняют при записи и удалении, а 304
+    возвращается только по ETag. Атрибут etag_models перечисляет модели,
+    которые меняют ответ, не попадая в probes, например через счетчики.
+    """
+    etag_models = ()
+
+    def get_list_probes(self) -> list:
+        return [self.filter_queryset(self.get_queryset())]
+
+    def get_object_probes(self) -> list:
+        """Некорректное значение lookup дает 404, как в
+        rest_framework.generics.get_object_or_404.
+        """
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            return [self.get_queryset().filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})]
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional_response(
+            self.get_list_probes(), super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional_response(
+            self.get_object_probes(), super().retrieve,
+            request, *args, **kwargs)
+
+    def _conditional_response(self, probes, handler, request, *args,
+                              **kwargs):
+        rows = probe_querysets(probes)
+        versions = [get_count_version(model) for model in
+                    [x.model for x in probes] + list(self.etag_models)]
+        etag = '"{}"'.format(hashlib.md5(
+            f'{request.user.pk}:{request.get_full_path()}:{rows}:{versions}'
+            .encode()
+        ).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            last_modified = [x[1] for x in rows if x[1] is not None]
+            if last_modified:
+                response['Last-Modified'] = http_date(
+                    max(last_modified).timestamp())
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization', ))
+        return response